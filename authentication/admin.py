@@ -1,3 +1,12 @@
 from django.contrib import admin
+from .models import ApiToken
 
 # Register your models here.
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'key', 'is_active', 'created')
+    search_fields = ('name', 'user__username')
+    list_filter = ('is_active',)
+    readonly_fields = ('key', 'created')
+
+
+admin.site.register(ApiToken, ApiTokenAdmin)
@@ -1,3 +1,25 @@
+import secrets
+
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class ApiToken(models.Model):
+    key = models.CharField(max_length=64, unique=True, editable=False)
+    name = models.CharField(max_length=255)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='api_tokens')
+    is_active = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "API token"
+        verbose_name_plural = "API tokens"
+
+    def save(self, *args, **kwargs):
+        # generate the key on first save
+        if not self.key:
+            self.key = secrets.token_hex(32)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} ({self.user})"
@@ -1,3 +1,21 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from .models import ApiToken
+
+
+class ApiTokenTests(TestCase):
+
+    def test_key_is_generated_once(self):
+        token = ApiToken.objects.create(user=User.objects.create_user('api'), name='test')
+        self.assertEqual(len(token.key), 64)
+        key = token.key
+        token.name = 'renamed'
+        token.save()
+        token.refresh_from_db()
+        self.assertEqual(token.key, key)
+
+    def test_keys_are_unique(self):
+        user = User.objects.create_user('api')
+        keys = {ApiToken.objects.create(user=user, name=str(i)).key for i in range(5)}
+        self.assertEqual(len(keys), 5)
@@ -82,6 +82,17 @@ DATABASES = {
     }
 }
 
+# The cache holds the lock against duplicate submissions of the progress stream.
+# The default local memory cache is per process, deployments with several worker
+# processes need a shared backend, e.g. CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+# with CACHE_LOCATION=xml_editor_cache (create it with `manage.py createcachetable`)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -112,3 +123,29 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'core/static')]
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Maximum size of a (decompressed) document accepted by the API
+API_MAX_DOCUMENT_SIZE = int(os.getenv('API_MAX_DOCUMENT_SIZE', 50 * 1024 * 1024))
+
+# Maximum size of a single XML document decompressed from an uploaded .gz or .zip file
+MAX_DECOMPRESSED_SIZE = int(os.getenv('MAX_DECOMPRESSED_SIZE', 500 * 1024 * 1024))
+
+# Serve the order and receipt forms with the async views (for ASGI deployments, see core/asgi.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0').lower() in ['true', 't', '1']
+
+# Number of threads for parsing and transforming XML in the async views
+ASYNC_CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', os.cpu_count() or 1))
+
+# Processing run history, detailed runs are rolled up into daily totals after
+# RUN_HISTORY_RETENTION_DAYS, daily totals are kept for RUN_HISTORY_DAILY_RETENTION_DAYS
+# (see the prune_runs command)
+RUN_HISTORY_ENABLED = os.getenv('RUN_HISTORY_ENABLED', '1').lower() in ['true', 't', '1']
+RUN_HISTORY_RETENTION_DAYS = int(os.getenv('RUN_HISTORY_RETENTION_DAYS', 30))
+RUN_HISTORY_DAILY_RETENTION_DAYS = int(os.getenv('RUN_HISTORY_DAILY_RETENTION_DAYS', 365))
+
+# How long (in seconds) the product feed is reused before it is downloaded again, 0 disables the cache
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', 300))
+
+# Memory limit (in bytes of serialized feed and memoized set bundles) of the catalogs of all shop profiles,
+# least recently used catalogs are dropped above it
+CATALOG_CACHE_MAX_BYTES = int(os.getenv('CATALOG_CACHE_MAX_BYTES', 256 * 1024 * 1024))
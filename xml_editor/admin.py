@@ -1,12 +1,56 @@
 from django.contrib import admin
-from .models import Settings
+from .models import ProcessingRun, ProcessingRunDaily, Settings, ShopProfile
 
 # Register your models here.
 class SettingsAdmin(admin.ModelAdmin):
-    list_display = ('name', 'code', 'value', 'category')
+    list_display = ('name', 'code', 'value', 'category', 'profile')
     search_fields = ('name', 'code', 'category')
-    list_filter = ('category',)
-    ordering = ('category', 'name')
+    list_filter = ('profile', 'category')
+    ordering = ('profile', 'category', 'name')
 
 
-admin.site.register(Settings, SettingsAdmin)
\ No newline at end of file
+class ShopProfileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug')
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # new shops start with a copy of the default shop settings
+        default = ShopProfile.get_default()
+        if not change and default is not None and default != obj:
+            obj.copy_settings_from(default)
+
+
+class ProcessingRunAdmin(admin.ModelAdmin):
+    list_display = (
+        'created', 'kind', 'source', 'profile', 'success', 'input_bytes', 'invoices', 'items',
+        'set_cache_hits', 'set_cache_misses', 'duration',
+    )
+    list_filter = ('kind', 'source', 'success', 'profile')
+    date_hierarchy = 'created'
+
+    # runs are recorded by the application only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ProcessingRunDailyAdmin(admin.ModelAdmin):
+    list_display = ('date', 'kind', 'profile', 'runs', 'failed_runs', 'input_bytes', 'duration', 'max_duration')
+    list_filter = ('kind', 'profile')
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(Settings, SettingsAdmin)
+admin.site.register(ShopProfile, ShopProfileAdmin)
+admin.site.register(ProcessingRun, ProcessingRunAdmin)
+admin.site.register(ProcessingRunDaily, ProcessingRunDailyAdmin)
@@ -0,0 +1,223 @@
+import io
+import zipfile
+import zlib
+from functools import wraps
+
+from django.conf import settings as django_settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from authentication.models import ApiToken
+from .catalog import get_catalog
+from .history import RunRecorder
+from .models import Settings, ShopProfile
+from .pipeline import STAGES, needs_catalog
+from .uploads import (
+    DocumentTooLarge, LimitedReader, UnsupportedUpload, documents_response, open_xml_sources, prefixed_name
+)
+from .utils import process_orders_xml, parse_receipt_xml, create_receipt_xml
+
+
+class ApiError(Exception):
+    """Error returned to the API client as a structured JSON response"""
+
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def error_response(status, code, message):
+    """Return JSON response with a list of errors"""
+    return JsonResponse({'errors': [{'code': code, 'message': message}]}, status=status)
+
+
+def authenticate_token(request):
+    """
+    Return the active API token from the Authorization header
+
+    Expected header format: ``Authorization: Token <key>``
+
+    Raises:
+        ApiError: If the token is missing, unknown or inactive
+    """
+    header = request.headers.get('Authorization', '')
+    scheme, _, key = header.partition(' ')
+    if scheme.lower() != 'token' or not key:
+        raise ApiError(401, 'not_authenticated', 'Missing API token.')
+    token = ApiToken.objects.select_related('user').filter(
+        key=key.strip(), is_active=True, user__is_active=True
+    ).first()
+    if token is None:
+        raise ApiError(401, 'invalid_token', 'Invalid or inactive API token.')
+    return token
+
+
+# File name used for the request body by its Content-Type, see open_xml_sources
+BODY_NAMES = {
+    'application/zip': 'document.zip',
+    'application/x-zip-compressed': 'document.zip',
+    'application/gzip': 'document.xml.gz',
+    'application/x-gzip': 'document.xml.gz',
+}
+
+# Errors of corrupted compressed bodies raised while the documents are read
+DECODING_ERRORS = (OSError, EOFError, zlib.error, zipfile.BadZipFile)
+
+
+def request_size(request):
+    """Return size of the (possibly compressed) request body in bytes"""
+    return int(request.META.get('CONTENT_LENGTH') or 0)
+
+
+def read_documents(request):
+    """
+    Return the XML documents of the request body as (name, stream) tuples
+
+    The body is decompressed while it is parsed. It may be gzip encoded
+    (``Content-Encoding: gzip``), a gzip file (``Content-Type: application/gzip``)
+    or a ZIP archive with XML files (``Content-Type: application/zip``).
+    The size of every decoded document is limited by ``API_MAX_DOCUMENT_SIZE``.
+
+    Raises:
+        ApiError: If the body is empty, or its type or encoding is not supported
+    """
+    max_size = django_settings.API_MAX_DOCUMENT_SIZE
+    if request_size(request) == 0:
+        raise ApiError(400, 'empty_document', 'Request body is empty.')
+
+    body = LimitedReader(request, max_size)
+    name = BODY_NAMES.get(request.content_type, 'document.xml')
+    if name.endswith('.zip'):
+        # ZIP archives need a seekable file, only the compressed body is buffered
+        try:
+            body = io.BytesIO(body.read())
+        except DocumentTooLarge as e:
+            raise ApiError(413, 'document_too_large', str(e))
+    try:
+        return list(open_xml_sources(body, name, request.headers.get('Content-Encoding'), max_size))
+    except UnsupportedUpload as e:
+        raise ApiError(415, 'unsupported_encoding', str(e))
+    except DECODING_ERRORS as e:
+        raise ApiError(400, 'invalid_encoding', f'Could not decode the request body: {e}')
+
+
+def convert_documents(documents, convert, prefix):
+    """
+    Convert every document with convert(stream) and map read errors to ApiError
+
+    Returns:
+        list: (prefixed file name, converted XML) tuples
+    """
+    results = []
+    for name, stream in documents:
+        try:
+            results.append((prefixed_name(prefix, name), convert(stream)))
+        except DocumentTooLarge as e:
+            raise ApiError(413, 'document_too_large', str(e))
+        except DECODING_ERRORS as e:
+            raise ApiError(400, 'invalid_encoding', f'Could not decode {name}: {e}')
+    return results
+
+
+def get_profile(request):
+    """
+    Return shop profile from the ``profile`` query parameter, the default profile otherwise
+
+    Raises:
+        ApiError: If the profile does not exist
+    """
+    slug = request.GET.get('profile')
+    profile = ShopProfile.objects.filter(slug=slug).first() if slug else ShopProfile.get_default()
+    if profile is None:
+        raise ApiError(404, 'unknown_profile', f'Shop profile not found: {slug}')
+    return profile
+
+
+def api_view(view):
+    """Authenticate the request and turn ApiError into a JSON response"""
+    @csrf_exempt
+    @require_POST
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            request.api_token = authenticate_token(request)
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return error_response(e.status, e.code, e.message)
+    return wrapper
+
+
+@api_view
+def orders(request):
+    """
+    Convert Shoptet orders XML and return the modified document
+
+    Archives with several XML files return a ZIP archive. The shop is
+    selected with the ``profile`` query parameter. Pipeline stages can be
+    skipped with the ``skip`` query parameter,
+    e.g. ``?skip=assign_store,bank_account``.
+    """
+    skip_stages = [name for name in request.GET.get('skip', '').split(',') if name]
+    unknown = [name for name in skip_stages if name not in STAGES]
+    if unknown:
+        raise ApiError(400, 'unknown_stage', f"Unknown pipeline stages: {', '.join(unknown)}")
+
+    profile = get_profile(request)
+    try:
+        order_settings = Settings.get_order_settings(profile)
+    except Settings.DoesNotExist as e:
+        raise ApiError(500, 'missing_settings', str(e))
+
+    with RunRecorder('orders', 'api', profile, request_size(request)) as run:
+        catalog = None
+        if needs_catalog(order_settings, skip_stages):
+            catalog = run.catalog = get_catalog(order_settings['feed_url'], order_settings['hash'], profile.slug)
+            if catalog is None:
+                raise ApiError(502, 'feed_unavailable', 'Could not load the product feed.')
+
+        def convert(stream):
+            modified_xml = convert_order(stream, catalog, run.stats, skip_stages, order_settings)
+            run.documents += 1
+            return modified_xml
+
+        documents = convert_documents(read_documents(request), convert, 'modified_')
+    return documents_response(documents, 'modified_document.zip', run.stats['timings'])
+
+
+def convert_order(stream, catalog, stats, skip_stages, order_settings):
+    """Run process_orders_xml on one document and map its failures to ApiError"""
+    try:
+        modified_xml = process_orders_xml(
+            xml_data=stream, xml_feed=catalog, stats=stats, skip_stages=skip_stages, **order_settings
+        )
+    except (ApiError, DocumentTooLarge, *DECODING_ERRORS):
+        raise
+    except Exception as e:
+        raise ApiError(422, 'processing_failed', f'Could not process XML: {e}')
+    if modified_xml is None:
+        raise ApiError(400, 'invalid_xml', 'Document is not valid XML.')
+    return modified_xml
+
+
+@api_view
+def receipts(request):
+    """Convert Pohoda receipt XML to the Shoptet stock import XML"""
+    with RunRecorder('receipts', 'api', input_bytes=request_size(request)) as run:
+        def convert(stream):
+            try:
+                receipt_items = parse_receipt_xml(stream)
+                xml_data = create_receipt_xml(receipt_items)
+            except ValueError as e:
+                # parse_receipt_xml wraps read errors of the stream
+                if isinstance(e.__cause__, (DocumentTooLarge, *DECODING_ERRORS)):
+                    raise e.__cause__
+                raise ApiError(400, 'invalid_xml', str(e))
+            run.documents += 1
+            run.stats['items'] = run.stats.get('items', 0) + len(receipt_items)
+            return xml_data
+
+        documents = convert_documents(read_documents(request), convert, 'parsed_')
+    return documents_response(documents, 'parsed_document.zip')
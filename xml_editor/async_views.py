@@ -0,0 +1,196 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import redirect
+
+from . import views
+from .catalog import CatalogUnavailable, get_catalog
+from .history import RunRecorder
+from .models import Settings, ShopProfile
+from .pipeline import needs_catalog
+from .uploads import documents_response, is_supported_upload, open_xml_sources, prefixed_name
+from .utils import create_receipt_xml, parse_orders_xml, parse_receipt_xml, serialize_orders_xml, update_unit_prices
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the bounded executor for the CPU-bound lxml work"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=django_settings.ASYNC_CPU_WORKERS,
+                thread_name_prefix='xml_editor'
+            )
+    return _executor
+
+
+async def run_cpu_bound(func, *args):
+    """Run func in the bounded executor without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), func, *args)
+
+
+async def is_authenticated(request):
+    # the user is loaded lazily from the session, which is synchronous
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+async def error_redirect(request, message, url_name):
+    await sync_to_async(messages.error)(request, message)
+    return redirect(url_name)
+
+
+def _open_upload(request):
+    """Return the uploaded file, the multipart body is parsed on first access"""
+    return request.FILES.get('xml_file')
+
+
+def _parse_documents(uploaded_file, parse, stats=None):
+    """Decompress and parse all XML documents of the upload"""
+    parsed = []
+    sources = open_xml_sources(uploaded_file, uploaded_file.name, max_size=django_settings.MAX_DECOMPRESSED_SIZE)
+    for name, stream in sources:
+        parsed.append((name, parse(stream, stats) if stats is not None else parse(stream)))
+    return parsed
+
+
+def _transform_orders(documents, order_settings, catalog, stats):
+    """Run the orders pipeline on parsed documents and serialize them"""
+    results = []
+    for name, root in documents:
+        if root is None:
+            raise ValueError(f'{name} není platný XML soubor')
+        update_unit_prices(root, xml_feed=catalog, stats=stats, **order_settings)
+        results.append((prefixed_name('modified_', name), serialize_orders_xml(root, stats)))
+    return results
+
+
+def _convert_receipts(documents):
+    return [(prefixed_name('parsed_', name), create_receipt_xml(items)) for name, items in documents]
+
+
+async def start_catalog_fetch(profile):
+    """
+    Load settings of the profile and start downloading its catalog in the background
+
+    Returns:
+        tuple: (order settings, task returning the catalog, None when expand_sets does not run)
+
+    Raises:
+        Settings.DoesNotExist: If settings of the profile are missing
+    """
+    order_settings = await sync_to_async(Settings.get_order_settings)(profile)
+    if not needs_catalog(order_settings):
+        return order_settings, None
+    task = asyncio.ensure_future(sync_to_async(get_catalog, thread_sensitive=False)(
+        order_settings['feed_url'], order_settings['hash'], profile.slug
+    ))
+    return order_settings, task
+
+
+async def discard_task(task):
+    """Cancel the task and collect its result, so no exception is left unretrieved"""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+
+async def await_catalog(task):
+    """Return the catalog of the fetch task, None when the feed is not used"""
+    if task is None:
+        return None
+    catalog = await task
+    if catalog is None:
+        # do not fall back to the blocking download of the pipeline in the CPU executor
+        raise CatalogUnavailable()
+    return catalog
+
+
+async def index(request):
+    """
+    Async version of views.index
+
+    The catalog download starts as soon as the shop profile is known, before
+    the upload is read, and runs while the upload is parsed. The profile
+    remembered in the session is used until the form is read, a different
+    profile selected in the form restarts the download. Parsing, the pipeline
+    and serialization run in a bounded executor.
+    """
+    if not await is_authenticated(request):
+        return redirect_to_login(request.get_full_path(), '/auth/login')
+    if request.method != 'POST':
+        return await sync_to_async(views.index)(request)
+
+    # the profile remembered in the session is known before the request body is read
+    profile = await sync_to_async(views.get_shop_profile)(request)
+    order_settings = catalog_task = None
+    try:
+        order_settings, catalog_task = await start_catalog_fetch(profile)
+    except Settings.DoesNotExist:
+        # the form may select another shop, missing settings are reported below
+        pass
+
+    uploaded_file = await sync_to_async(_open_upload)(request)
+    if uploaded_file is None or not is_supported_upload(uploaded_file.name):
+        await discard_task(catalog_task)
+        return await error_redirect(request, 'Prosím vyberte XML soubor nebo archiv (.xml, .xml.gz, .zip).', 'home')
+
+    selected = request.POST.get('profile')
+    if order_settings is None or (selected and selected != profile.slug):
+        await discard_task(catalog_task)
+        try:
+            profile = await sync_to_async(views.get_shop_profile)(request, selected)
+            order_settings, catalog_task = await start_catalog_fetch(profile)
+        except ShopProfile.DoesNotExist as e:
+            return await error_redirect(request, str(e), 'home')
+        except Settings.DoesNotExist as e:
+            return await error_redirect(request, f'Nepovedlo se zpracovat XML soubor: {e}', 'home')
+
+    run = RunRecorder('orders', 'async', profile, uploaded_file.size)
+    try:
+        documents = await run_cpu_bound(_parse_documents, uploaded_file, parse_orders_xml, run.stats)
+        catalog = run.catalog = await await_catalog(catalog_task)
+        results = await run_cpu_bound(_transform_orders, documents, order_settings, catalog, run.stats)
+    except Exception as e:
+        await discard_task(catalog_task)
+        await sync_to_async(run.finish)(e)
+        return await error_redirect(request, f'Nepovedlo se zpracovat XML soubor: {e}', 'home')
+
+    run.documents = len(results)
+    await sync_to_async(run.finish)()
+    return documents_response(results, f'modified_{uploaded_file.name}')
+
+
+async def receipts(request):
+    """Async version of views.receipts, parsing runs in a bounded executor"""
+    if request.method != 'POST':
+        return await sync_to_async(views.receipts)(request)
+
+    uploaded_file = await sync_to_async(_open_upload)(request)
+    if uploaded_file is None or not is_supported_upload(uploaded_file.name):
+        return await error_redirect(request, 'Prosím vyberte XML soubor nebo archiv (.xml, .xml.gz, .zip).', 'receipts')
+
+    run = RunRecorder('receipts', 'async', input_bytes=uploaded_file.size)
+    try:
+        documents = await run_cpu_bound(_parse_documents, uploaded_file, parse_receipt_xml)
+        results = await run_cpu_bound(_convert_receipts, documents)
+    except Exception as e:
+        await sync_to_async(run.finish)(e)
+        return await error_redirect(request, f'Nepovedlo se zpracovat XML soubor: {e}', 'receipts')
+
+    run.documents = len(results)
+    run.stats['items'] = sum(len(items) for _, items in documents)
+    await sync_to_async(run.finish)()
+    return documents_response(results, f'parsed_{uploaded_file.name}')
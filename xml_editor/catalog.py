@@ -0,0 +1,270 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .utils import fetch_and_parse_xml_feed
+
+VAT_RATE = {
+    '21': 'high',
+    '12': 'medium',
+    '10': 'low',
+}
+
+
+class CatalogUnavailable(Exception):
+    """Product feed needed by the run could not be loaded"""
+
+    def __init__(self, message='Nepodařilo se načíst produktový feed.'):
+        super().__init__(message)
+
+
+class ProductCatalog:
+    """
+    Product feed indexed by product code
+
+    Expanded set bundles (e.g. ``102246_100239``) are memoized per currency
+    and exchange rate, so every further occurrence of the same bundle costs
+    a single dictionary lookup. The cache lives on the catalog instance,
+    a new catalog version always starts with an empty cache. Bundles of the
+    foreign currency are kept for the latest exchange rate only, and the
+    memo is included in the catalog size. Misses are memoized under a lock,
+    a catalog can be shared by threads.
+    """
+
+    def __init__(self, products):
+        self.products = {}
+        for product in products:
+            # keep the first product for duplicate codes
+            self.products.setdefault(product['PRODUCT_CODE'], product)
+        serialized = json.dumps(products, sort_keys=True, default=str).encode('utf-8')
+        self.version = hashlib.sha1(serialized).hexdigest()
+        self.feed_size = len(serialized)
+        self.bundles_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._bundles = {}
+        self._eur_rate = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks cannot be pickled, e.g. for process_xml workers
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Approximate memory footprint in bytes, used by the catalog cache"""
+        return self.feed_size + self.bundles_size
+
+    def expand_bundle(self, bundle_id, currency, eur_rate=None, stats=None):
+        """
+        Return invoice item data of all components of a set bundle
+
+        Components missing in the feed are left out and counted in
+        stats['unmatched_codes']. The returned item data do not contain
+        quantity, it has to be set from the invoice item.
+
+        Args:
+            bundle_id (str): Stock item id of the set, component ids joined by underscore
+            currency (str): 'home' or 'foreign'
+            eur_rate (str/float): EUR exchange rate, used for the foreign currency
+            stats (dict, optional): Per run counters updated with cache hits, misses and unmatched codes
+
+        Returns:
+            tuple: Item data dictionaries of the components
+        """
+        key = (bundle_id, currency, eur_rate if currency == 'foreign' else None)
+        entry = self._bundles.get(key)
+        hit = entry is not None
+        if not hit:
+            # the catalog is shared by threads, a bundle is computed and counted once
+            with self._lock:
+                entry = self._bundles.get(key)
+                hit = entry is not None
+                if not hit:
+                    entry = self._memoize_bundle(key, bundle_id, currency, eur_rate)
+        if hit:
+            self.hits += 1
+            counter = 'set_cache_hits'
+        else:
+            self.misses += 1
+            counter = 'set_cache_misses'
+
+        items, unmatched, _ = entry
+        if stats is not None:
+            stats[counter] = stats.get(counter, 0) + 1
+            if unmatched:
+                stats['unmatched_codes'] = stats.get('unmatched_codes', 0) + unmatched
+        return items
+
+    def _memoize_bundle(self, key, bundle_id, currency, eur_rate):
+        """Compute and store the memo entry of a bundle, called with the lock held"""
+        if currency == 'foreign' and eur_rate != self._eur_rate:
+            self._drop_foreign_bundles()
+            self._eur_rate = eur_rate
+        stock_item_ids = bundle_id.split('_')
+        items = tuple(
+            self._component_item_data(product, stock_item_id, currency, eur_rate)
+            for stock_item_id in stock_item_ids
+            for product in [self.products.get(stock_item_id)]
+            if product is not None
+        )
+        size = len(json.dumps(items)) + len(bundle_id)
+        entry = (items, len(stock_item_ids) - len(items), size)
+        self._bundles[key] = entry
+        self.bundles_size += size
+        return entry
+
+    def _drop_foreign_bundles(self):
+        """Drop bundles memoized for a previous exchange rate, called with the lock held"""
+        for key in [key for key in list(self._bundles) if key[1] == 'foreign']:
+            entry = self._bundles.pop(key, None)
+            if entry is not None:
+                self.bundles_size -= entry[2]
+
+    def _component_item_data(self, product_obj, stock_item_id, currency, eur_rate):
+        if currency == 'home':
+            unit_price = float(product_obj['PRICE_VAT'])
+            price = float(product_obj['PRICE'])
+            price_vat = float(product_obj['PRICE_VAT']) - float(product_obj['PRICE'])
+        else:
+            exchange_rate = float(eur_rate)
+            unit_price = round(float(product_obj['PRICE_VAT']) / exchange_rate, 2)
+            price = round(float(product_obj['PRICE']) / exchange_rate, 2)
+            price_vat = round((float(product_obj['PRICE_VAT']) - float(product_obj['PRICE'])) / exchange_rate, 2)
+        return {
+            'text': product_obj['PRODUCT'],
+            'unit': 'ks',
+            'payVAT': False,
+            'rateVAT': VAT_RATE.get(str(product_obj['VAT']), 'high'),
+            'unitPrice': unit_price,
+            'price': price,
+            'priceVAT': price_vat,
+            'stockItemId': stock_item_id,
+            'code': stock_item_id,
+        }
+
+    def cache_info(self):
+        """Return bundle cache counters of this catalog version"""
+        return {
+            'version': self.version,
+            'products': len(self.products),
+            'bundles': len(self._bundles),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class CatalogCache:
+    """
+    Catalogs of all tenants with TTL expiry and memory-bounded LRU eviction
+
+    The size of a catalog is approximated by the size of its serialized
+    feed and its memoized bundles. The memo grows while a catalog is used,
+    so the limit is checked on every lookup as well as when a catalog is
+    added. When the total exceeds max_bytes, the least recently used
+    catalogs are dropped, the most recently used one is always kept.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, ttl, max_bytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, None
+            self._entries.move_to_end(key)
+            self._evict(max_bytes)
+        loaded_at, catalog = entry
+        if time.monotonic() - loaded_at >= ttl:
+            return None, catalog
+        return catalog, catalog
+
+    def put(self, key, catalog, max_bytes):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), catalog)
+            self._entries.move_to_end(key)
+            self._evict(max_bytes)
+
+    def _evict(self, max_bytes):
+        total = sum(entry[1].size for entry in self._entries.values())
+        while total > max_bytes and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            total -= evicted.size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """Return cached catalogs per tenant"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return {
+            'catalogs': len(entries),
+            'bytes': sum(catalog.size for _, (_, catalog) in entries),
+            'evictions': self.evictions,
+            'tenants': {str(key[0]): catalog.cache_info() for key, (_, catalog) in entries},
+        }
+
+
+_catalogs = CatalogCache()
+
+
+def get_catalog(feed_url, api_key, tenant=None):
+    """
+    Return product catalog for the feed, cached for CATALOG_CACHE_TTL seconds
+
+    Every tenant (shop profile) has its own catalog. When the refreshed feed
+    has the same content, the cached catalog is kept together with its
+    expanded bundles. The total size of cached catalogs is limited by
+    CATALOG_CACHE_MAX_BYTES.
+
+    Args:
+        feed_url (str): URL of the feed
+        api_key (str): Hash for authentication
+        tenant (str, optional): Shop profile the catalog belongs to
+
+    Returns:
+        ProductCatalog: The catalog or None if the feed could not be loaded
+    """
+    key = (tenant, feed_url, api_key)
+    ttl = settings.CATALOG_CACHE_TTL
+    max_bytes = settings.CATALOG_CACHE_MAX_BYTES
+    catalog, stale = _catalogs.get(key, ttl, max_bytes) if ttl > 0 else (None, None)
+    if catalog is not None:
+        return catalog
+
+    products = fetch_and_parse_xml_feed(feed_url, api_key)
+    if products is None:
+        return None
+    catalog = ProductCatalog(products)
+    if stale is not None and stale.version == catalog.version:
+        catalog = stale
+    if ttl > 0:
+        _catalogs.put(key, catalog, max_bytes)
+    return catalog
+
+
+def clear_catalogs():
+    """Drop all cached catalogs"""
+    _catalogs.clear()
+
+
+def catalog_cache_info():
+    """Return statistics of the cached catalogs"""
+    return _catalogs.info()
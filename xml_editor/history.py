@@ -0,0 +1,197 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ProcessingRun, ProcessingRunDaily
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Counters of the run stats copied to ProcessingRun
+RUN_COUNTERS = ('invoices', 'items', 'sets_expanded', 'unmatched_codes', 'set_cache_hits', 'set_cache_misses')
+
+# Fields summed when runs are rolled up into daily totals
+DAILY_SUMS = (
+    'input_bytes', 'documents', 'invoices', 'items', 'sets_expanded', 'unmatched_codes',
+    'set_cache_hits', 'set_cache_misses', 'duration',
+)
+
+# Per-day totals the dashboard series is computed from
+SERIES_FIELDS = ('runs', 'failed_runs', 'input_bytes', 'duration', 'max_duration')
+
+
+def process_peak_memory():
+    """
+    Return peak resident memory of the process in bytes, None when unknown
+
+    This is the high-water mark over the whole life of the process, not of
+    a single run. In a long-lived worker many runs record the same value.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunRecorder:
+    """
+    Collect statistics of one conversion and store them as ProcessingRun
+
+    Pass ``stats`` to process_orders_xml and update ``documents`` and
+    ``catalog`` while the run goes on. Used as a context manager, the run
+    is saved on exit and marked as failed when an exception is raised.
+    Async code calls finish() through sync_to_async instead.
+    """
+
+    def __init__(self, kind, source, profile=None, input_bytes=0):
+        self.kind = kind
+        self.source = source
+        self.profile = profile
+        self.input_bytes = input_bytes or 0
+        self.documents = 0
+        self.catalog = None
+        self.stats = {}
+        self.start = time.perf_counter()
+        self.finished = False
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.finish(exc)
+        return False
+
+    def finish(self, error=None):
+        """Save the run, errors are reported but never raised"""
+        if self.finished or not settings.RUN_HISTORY_ENABLED:
+            return None
+        self.finished = True
+        try:
+            return ProcessingRun.objects.create(
+                kind=self.kind,
+                source=self.source,
+                profile=self.profile,
+                success=error is None,
+                error=str(error)[:255] if error is not None else '',
+                input_bytes=self.input_bytes,
+                documents=self.documents,
+                duration=time.perf_counter() - self.start,
+                stage_timings={name: round(seconds, 6) for name, seconds in self.stats.get('timings', {}).items()},
+                process_peak_memory=process_peak_memory(),
+                catalog_version=getattr(self.catalog, 'version', '') or '',
+                **{counter: self.stats.get(counter, 0) for counter in RUN_COUNTERS}
+            )
+        except Exception as e:
+            print(f"Error saving processing run: {e}")
+            return None
+
+
+def rollup_runs(before):
+    """
+    Add runs created before the given time to the daily totals and delete them
+
+    Returns:
+        int: Number of rolled up runs
+    """
+    runs = ProcessingRun.objects.filter(created__lt=before)
+    with transaction.atomic():
+        groups = (
+            runs.annotate(date=TruncDate('created'))
+            .values('date', 'kind', 'profile')
+            .annotate(
+                runs=Count('id'),
+                failed_runs=Count('id', filter=Q(success=False)),
+                max_duration=Max('duration'),
+                **{f'sum_{field}': Sum(field) for field in DAILY_SUMS}
+            )
+        )
+        for group in groups:
+            daily, _ = ProcessingRunDaily.objects.select_for_update().get_or_create(
+                date=group['date'], kind=group['kind'], profile_id=group['profile']
+            )
+            daily.runs += group['runs']
+            daily.failed_runs += group['failed_runs']
+            daily.max_duration = max(daily.max_duration, group['max_duration'] or 0)
+            for field in DAILY_SUMS:
+                setattr(daily, field, getattr(daily, field) + (group[f'sum_{field}'] or 0))
+            daily.save()
+        deleted, _ = runs.delete()
+    return deleted
+
+
+def prune_history(now=None):
+    """
+    Apply the retention policy
+
+    Runs older than RUN_HISTORY_RETENTION_DAYS are rolled up into daily
+    totals, daily totals older than RUN_HISTORY_DAILY_RETENTION_DAYS are deleted.
+
+    Returns:
+        tuple: (rolled up runs, deleted daily totals)
+    """
+    now = now or timezone.now()
+    rolled_up = rollup_runs(now - timedelta(days=settings.RUN_HISTORY_RETENTION_DAYS))
+    daily_before = (now - timedelta(days=settings.RUN_HISTORY_DAILY_RETENTION_DAYS)).date()
+    deleted, _ = ProcessingRunDaily.objects.filter(date__lt=daily_before).delete()
+    return rolled_up, deleted
+
+
+def daily_series(days, kind=None):
+    """
+    Return per-day totals of the last days, from both runs and daily totals
+
+    Returns:
+        list: Dictionaries with date, runs, failed_runs, throughput (MB/s),
+            avg_latency and max_latency (ms), sorted by date
+    """
+    since = timezone.now() - timedelta(days=days)
+    runs = ProcessingRun.objects.filter(created__gte=since)
+    daily = ProcessingRunDaily.objects.filter(date__gte=since.date())
+    if kind:
+        runs = runs.filter(kind=kind)
+        daily = daily.filter(kind=kind)
+
+    totals = {}
+
+    def add(date, row):
+        day = totals.setdefault(date, dict.fromkeys(SERIES_FIELDS, 0))
+        for field in SERIES_FIELDS[:-1]:
+            day[field] += row[field] or 0
+        day['max_duration'] = max(day['max_duration'], row['max_duration'] or 0)
+
+    run_groups = (
+        runs.annotate(date=TruncDate('created')).values('date')
+        .annotate(
+            total_runs=Count('id'),
+            total_failed_runs=Count('id', filter=Q(success=False)),
+            total_input_bytes=Sum('input_bytes'),
+            total_duration=Sum('duration'),
+            total_max_duration=Max('duration'),
+        )
+    )
+    for group in run_groups:
+        # aggregates cannot reuse names of the model fields
+        add(group['date'], {field: group[f'total_{field}'] for field in SERIES_FIELDS})
+    for group in daily.values('date', *SERIES_FIELDS):
+        add(group['date'], group)
+
+    series = []
+    for date in sorted(totals):
+        day = totals[date]
+        series.append({
+            'date': date.isoformat(),
+            'runs': day['runs'],
+            'failed_runs': day['failed_runs'],
+            'throughput': round(day['input_bytes'] / 1_000_000 / day['duration'], 3) if day['duration'] else 0,
+            'avg_latency': round(day['duration'] / day['runs'] * 1000, 1) if day['runs'] else 0,
+            'max_latency': round(day['max_duration'] * 1000, 1),
+        })
+    return series
@@ -0,0 +1,371 @@
+import json
+import math
+import random
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from xml_editor.models import ORDER_SETTING_CODES, ProcessingRun, Settings, ShopProfile
+
+LOADTEST_USERNAME = 'loadtest'
+LOADTEST_PROFILE = 'loadtest'
+
+ORDER_NAMESPACES = (
+    'xmlns:dat="http://www.stormware.cz/schema/version_2/data.xsd" '
+    'xmlns:inv="http://www.stormware.cz/schema/version_2/invoice.xsd" '
+    'xmlns:typ="http://www.stormware.cz/schema/version_2/type.xsd"'
+)
+
+
+def build_products(count):
+    """Return product feed data served by the stub feed server"""
+    return [
+        {
+            'PRODUCT_CODE': str(100000 + i),
+            'PRODUCT': f'Produkt {i}',
+            'PRICE': f'{(100 + i) / 1.21:.2f}',
+            'PRICE_VAT': str(100 + i),
+            'VAT': '21',
+        }
+        for i in range(count)
+    ]
+
+
+def build_orders_xml(invoices, items, products, rng):
+    """Return Shoptet orders XML with the given number of invoices and items per invoice"""
+    codes = [product['PRODUCT_CODE'] for product in products]
+    parts = [f'<?xml version="1.0" encoding="UTF-8"?>\n<dat:dataPack {ORDER_NAMESPACES} id="loadtest" version="2.0">']
+    for invoice_no in range(invoices):
+        foreign = invoice_no % 2 == 1
+        currency = 'inv:foreignCurrency' if foreign else 'inv:homeCurrency'
+        parts.append(
+            f'<dat:dataPackItem id="{invoice_no}" version="2.0"><inv:invoice version="2.0">'
+            '<inv:invoiceHeader><inv:invoiceType>issuedInvoice</inv:invoiceType></inv:invoiceHeader>'
+            '<inv:invoiceDetail>'
+        )
+        for item_no in range(items):
+            # every other item is a set of two products
+            if item_no % 2 == 0:
+                ids = '_'.join(rng.sample(codes, 2))
+            else:
+                ids = rng.choice(codes)
+            parts.append(
+                f'<inv:invoiceItem><inv:text>Položka {item_no}</inv:text><inv:quantity>{rng.randint(1, 5)}</inv:quantity>'
+                '<inv:unit>ks</inv:unit><inv:payVAT>false</inv:payVAT><inv:rateVAT>high</inv:rateVAT>'
+                f'<{currency}><typ:unitPrice>121</typ:unitPrice><typ:price>100</typ:price><typ:priceVAT>21</typ:priceVAT></{currency}>'
+                f'<inv:stockItem><typ:stockItem><typ:ids>{ids}</typ:ids></typ:stockItem></inv:stockItem>'
+                f'<inv:code>{ids}</inv:code></inv:invoiceItem>'
+            )
+        parts.append(
+            '<inv:invoiceItem><inv:text>Doprava</inv:text><inv:quantity>1</inv:quantity><inv:unit>ks</inv:unit>'
+            '<inv:payVAT>false</inv:payVAT><inv:rateVAT>high</inv:rateVAT>'
+            f'<{currency}><typ:unitPrice>100</typ:unitPrice><typ:price>82.64</typ:price><typ:priceVAT>17.36</typ:priceVAT></{currency}>'
+            '<inv:code>SHIPPING1</inv:code></inv:invoiceItem>'
+        )
+        summary = (
+            '<inv:foreignCurrency><typ:currency><typ:ids>EUR</typ:ids></typ:currency></inv:foreignCurrency>'
+            if foreign else '<inv:homeCurrency/>'
+        )
+        parts.append(f'</inv:invoiceDetail><inv:invoiceSummary>{summary}</inv:invoiceSummary></inv:invoice></dat:dataPackItem>')
+    parts.append('</dat:dataPack>')
+    return ''.join(parts).encode('utf-8')
+
+
+def build_receipt_xml(items, products, rng):
+    """Return Pohoda receipt XML with the given number of items"""
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<dat:dataPack xmlns:dat="http://www.stormware.cz/schema/version_2/data.xsd" '
+        'xmlns:pri="http://www.stormware.cz/schema/version_2/prijemka.xsd">'
+        '<dat:dataPackItem id="1"><pri:prijemka><pri:prijemkaDetail>'
+    ]
+    for product in rng.sample(products, min(items, len(products))):
+        parts.append(
+            f'<pri:prijemkaItem><pri:text>{product["PRODUCT"]}</pri:text>'
+            f'<pri:quantity>{rng.randint(1, 20)}</pri:quantity><pri:code>{product["PRODUCT_CODE"]}</pri:code></pri:prijemkaItem>'
+        )
+    parts.append('</pri:prijemkaDetail></pri:prijemka></dat:dataPackItem></dat:dataPack>')
+    return ''.join(parts).encode('utf-8')
+
+
+def start_feed_server(products):
+    """Start stub product feed server in a background thread"""
+    body = json.dumps({'data': products}).encode('utf-8')
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_app_server():
+    """Serve core.wsgi in a background thread, used when no --url is given"""
+    from core.wsgi import application
+
+    server = make_server('127.0.0.1', 0, application,
+                         server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(sorted_values, percent):
+    """Return nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    # multiply first so that whole ranks stay exact, e.g. 7 * 100 / 100 and not 0.07 * 100
+    rank = max(math.ceil(percent * len(sorted_values) / 100) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """Return throughput and latency percentiles (in ms) of one request kind"""
+    values = sorted(latencies)
+    count = len(values) + errors
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': count / elapsed if elapsed > 0 else 0.0,
+        'p50': percentile(values, 50) * 1000,
+        'p95': percentile(values, 95) * 1000,
+        'p99': percentile(values, 99) * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Replay a mix of order, receipt and settings requests against a deployment '
+            'and report throughput and latency percentiles')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Base URL of a running deployment sharing this database '
+                                          '(default: serve core.wsgi in-process)')
+        parser.add_argument('--concurrency', type=int, default=10, help='Number of concurrent clients (default: 10)')
+        parser.add_argument('--requests', type=int, default=200, help='Total number of requests (default: 200)')
+        parser.add_argument('--mix', default='orders=5,receipts=3,settings=2',
+                            help='Weights of request kinds (default: orders=5,receipts=3,settings=2)')
+        parser.add_argument('--invoices', type=int, default=50, help='Invoices per order document (default: 50)')
+        parser.add_argument('--items', type=int, default=6, help='Items per invoice (default: 6)')
+        parser.add_argument('--products', type=int, default=2000, help='Products in the stub feed (default: 2000)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated documents')
+        parser.add_argument('--save-baseline', metavar='PATH', help='Save the results as a baseline JSON file')
+        parser.add_argument('--compare', metavar='PATH', help='Compare the results with a baseline JSON file')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Allowed relative p95/throughput regression against the baseline (default: 0.2)')
+
+    def parse_mix(self, mix):
+        weights = {}
+        for part in mix.split(','):
+            kind, _, weight = part.partition('=')
+            kind = kind.strip()
+            if kind not in ('orders', 'receipts', 'settings'):
+                raise CommandError(f'Unknown request kind in --mix: {kind}')
+            try:
+                weights[kind] = float(weight)
+            except ValueError:
+                raise CommandError(f'Invalid weight in --mix: {part}')
+        if not any(weights.values()):
+            raise CommandError('--mix needs at least one positive weight')
+        return weights
+
+    def seed(self, feed_url, documents):
+        """
+        Create the load test user and shop profile pointing to the stub feed
+
+        The user gets a random password valid for this run only, an existing
+        user of the same name is never modified.
+
+        Returns:
+            callable: Removes the seeded data and the recorded processing runs
+                of the load test from the database
+        """
+        if ShopProfile.objects.filter(slug=LOADTEST_PROFILE).exists():
+            raise CommandError(f'Shop profile "{LOADTEST_PROFILE}" already exists, remove it first')
+        if User.objects.filter(username=LOADTEST_USERNAME).exists():
+            raise CommandError(f'User "{LOADTEST_USERNAME}" already exists, remove it first')
+        profile = ShopProfile.objects.create(name='Load test', slug=LOADTEST_PROFILE)
+        values = {'feed_url': feed_url, 'eur_rate': '25'}
+        Settings.objects.bulk_create([
+            Settings(profile=profile, name=code, code=code, value=values.get(code, f'loadtest-{code}'), category='loadtest')
+            for code in ORDER_SETTING_CODES
+        ])
+
+        self.password = secrets.token_urlsafe(32)
+        user = User.objects.create_user(username=LOADTEST_USERNAME, password=self.password)
+        started = timezone.now()
+
+        def restore():
+            # keep the synthetic runs out of the processing statistics, they are
+            # deleted before the profile, which would leave them without a shop;
+            # receipt runs have no shop and are recognized by the generated document
+            ProcessingRun.objects.filter(created__gte=started).filter(
+                Q(profile=profile) | Q(kind='receipts', profile=None, input_bytes=len(documents['receipts']))
+            ).delete()
+            profile.delete()
+            user.delete()
+        return restore
+
+    def login(self, base_url):
+        """Return requests session logged in as the load test user"""
+        session = requests.Session()
+        response = session.get(f'{base_url}/auth/login/')
+        match = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.text)
+        token = match.group(1) if match else session.cookies.get('csrftoken', '')
+        response = session.post(f'{base_url}/auth/login/', data={
+            'csrfmiddlewaretoken': token,
+            'username': LOADTEST_USERNAME,
+            'password': self.password,
+        }, headers={'Referer': f'{base_url}/auth/login/'})
+        if 'sessionid' not in session.cookies:
+            raise CommandError(f'Could not log in to {base_url}')
+        return session
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be at least 1')
+        weights = self.parse_mix(options['mix'])
+        rng = random.Random(options['seed'])
+
+        products = build_products(options['products'])
+        documents = {
+            'orders': build_orders_xml(options['invoices'], options['items'], products, rng),
+            'receipts': build_receipt_xml(options['invoices'] * options['items'], products, rng),
+        }
+        kinds = list(weights)
+        plan = rng.choices(kinds, weights=[weights[kind] for kind in kinds], k=options['requests'])
+
+        feed_server = start_feed_server(products)
+        app_server = None
+        restore = self.seed(f'http://127.0.0.1:{feed_server.server_port}/', documents)
+        try:
+            if options['url']:
+                base_url = options['url'].rstrip('/')
+            else:
+                app_server = start_app_server()
+                base_url = f'http://127.0.0.1:{app_server.server_port}'
+            self.stdout.write(f'Target {base_url}, {options["requests"]} requests, concurrency {options["concurrency"]}')
+            results = self.run(base_url, plan, documents, options['concurrency'])
+        finally:
+            if app_server is not None:
+                app_server.shutdown()
+            feed_server.shutdown()
+            restore()
+
+        results['config'] = {key: options[key] for key in ('concurrency', 'requests', 'mix', 'invoices', 'items', 'products')}
+        self.report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Baseline saved to {options["save_baseline"]}')
+        if options['compare']:
+            self.compare(results, options['compare'], options['max_regression'])
+
+    def run(self, base_url, plan, documents, concurrency):
+        local = threading.local()
+        lock = threading.Lock()
+        latencies = {kind: [] for kind in set(plan)}
+        errors = {kind: 0 for kind in set(plan)}
+
+        def send(kind):
+            if not hasattr(local, 'session'):
+                local.session = self.login(base_url)
+            session = local.session
+            start = time.perf_counter()
+            try:
+                if kind == 'settings':
+                    response = session.get(f'{base_url}/settings/', params={'profile': LOADTEST_PROFILE})
+                else:
+                    path = '/' if kind == 'orders' else '/receipts/'
+                    response = session.post(
+                        f'{base_url}{path}',
+                        data={'csrfmiddlewaretoken': session.cookies.get('csrftoken', ''), 'profile': LOADTEST_PROFILE},
+                        files={'xml_file': (f'loadtest_{kind}.xml', documents[kind], 'application/xml')},
+                        headers={'Referer': f'{base_url}{path}'},
+                        allow_redirects=False,
+                    )
+                # failed conversions redirect back to the form
+                ok = response.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            latency = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies[kind].append(latency)
+                else:
+                    errors[kind] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(send, plan))
+        elapsed = time.perf_counter() - start
+
+        all_latencies = [latency for values in latencies.values() for latency in values]
+        return {
+            'elapsed': elapsed,
+            'total': summarize(all_latencies, sum(errors.values()), elapsed),
+            'kinds': {kind: summarize(latencies[kind], errors[kind], elapsed) for kind in sorted(latencies)},
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"kind":<10} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        rows = list(results['kinds'].items()) + [('total', results['total'])]
+        for kind, row in rows:
+            self.stdout.write(
+                f'{kind:<10} {row["requests"]:>8} {row["errors"]:>6} {row["throughput"]:>8.2f} '
+                f'{row["p50"]:>9.1f} {row["p95"]:>9.1f} {row["p99"]:>9.1f}'
+            )
+
+    def compare(self, results, path, max_regression):
+        """Print the difference to the baseline and fail on regressions"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read baseline {path}: {e}')
+
+        regressions = []
+        self.stdout.write(f'Compared with baseline {path}:')
+        for kind, row in list(results['kinds'].items()) + [('total', results['total'])]:
+            base = baseline['total'] if kind == 'total' else baseline.get('kinds', {}).get(kind)
+            if base is None:
+                continue
+            for metric, higher_is_better in (('throughput', True), ('p50', False), ('p95', False), ('p99', False)):
+                if not base[metric]:
+                    continue
+                change = (row[metric] - base[metric]) / base[metric]
+                self.stdout.write(f'  {kind:<10} {metric:<10} {base[metric]:>9.2f} -> {row[metric]:>9.2f} ({change:+.1%})')
+                regression = -change if higher_is_better else change
+                if metric in ('throughput', 'p95') and regression > max_regression:
+                    regressions.append(f'{kind} {metric} {change:+.1%}')
+        if regressions:
+            raise CommandError('Performance regression: ' + ', '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regression against the baseline'))
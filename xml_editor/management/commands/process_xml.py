@@ -0,0 +1,222 @@
+import glob
+import multiprocessing
+import os
+import time
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from xml_editor.catalog import ProductCatalog
+from xml_editor.history import RunRecorder
+from xml_editor.pipeline import STAGES, needs_catalog
+from xml_editor.uploads import is_supported_upload, open_xml_sources, prefixed_name
+from xml_editor.utils import fetch_and_parse_xml_feed, process_orders_xml, parse_receipt_xml, create_receipt_xml
+
+# Settings snapshot shared by all files of one run,
+# set up once per worker by _init_worker
+_worker_options = {}
+
+
+def _init_worker(options):
+    """Store the settings and catalog snapshot in the worker process"""
+    global _worker_options
+    _worker_options = options
+
+
+def _process_file(path, subdir):
+    """
+    Convert a single file and write the results to the output directory
+
+    Compressed files and archives are decompressed while they are parsed,
+    every XML document of an archive is written to its own output file.
+    Output paths are claimed in the shared ``claims`` mapping first, a file
+    that would overwrite the output of another input fails instead.
+
+    Args:
+        path (str): Path of the input XML file or archive
+        subdir (str): Directory of the input relative to the common input directory
+
+    Returns:
+        tuple: (path, input size in bytes, error message or None, stats)
+    """
+    options = _worker_options
+    size = os.path.getsize(path)
+    stats = {}
+    try:
+        with open(path, 'rb') as f:
+            for name, stream in open_xml_sources(f, path):
+                if options['mode'] == 'orders':
+                    output = process_orders_xml(xml_data=stream, xml_feed=options['catalog'], stats=stats,
+                                                skip_stages=options['skip_stages'], **options['settings'])
+                    if output is None:
+                        raise ValueError(f'Invalid XML data in {name}')
+                    prefix = 'modified_'
+                else:
+                    output = create_receipt_xml(parse_receipt_xml(stream))
+                    prefix = 'parsed_'
+
+                # documents of archives keep their folders from the archive
+                output_path = os.path.normpath(
+                    os.path.join(options['output_dir'], subdir, *prefixed_name(prefix, name).split('/'))
+                )
+                source = f'{name} from {path}'
+                owner = options['claims'].setdefault(output_path, source)
+                if owner != source:
+                    raise ValueError(f'{output_path} is already written for {owner}')
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                with open(output_path, 'w', encoding='utf-8') as output_file:
+                    output_file.write(output)
+                stats['documents'] = stats.get('documents', 0) + 1
+        return path, size, None, stats
+    except Exception as e:
+        return path, size, str(e), stats
+
+
+class Command(BaseCommand):
+    help = 'Process order or receipt XML files without the web interface'
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='+', help='XML files (also .xml.gz and .zip), directories or glob patterns')
+        parser.add_argument('--mode', choices=['orders', 'receipts'], default='orders',
+                            help='Conversion to run (default: orders)')
+        parser.add_argument('--output-dir', required=True, help='Directory for the converted files, folders of the inputs are mirrored in it')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of parallel workers (default: number of CPUs)')
+        parser.add_argument('--executor', choices=['process', 'thread'], default='process',
+                            help='Run workers as processes or threads (default: process)')
+        parser.add_argument('--profile', help='Slug of the shop profile (default: the first profile)')
+        parser.add_argument('--skip-stage', action='append', dest='skip_stages', default=[], choices=list(STAGES),
+                            help='Skip an orders pipeline stage, can be repeated')
+
+    def collect_files(self, inputs):
+        """Expand directories and glob patterns to a sorted list of XML files and archives"""
+        files = set()
+        for item in inputs:
+            if os.path.isdir(item):
+                files.update(path for path in glob.glob(os.path.join(item, '*')) if is_supported_upload(path))
+            else:
+                files.update(path for path in glob.glob(item) if os.path.isfile(path))
+        return sorted(files)
+
+    def output_subdirs(self, files):
+        """Return directories of the files relative to their common directory, mirrored in the output"""
+        directories = [os.path.dirname(os.path.abspath(path)) for path in files]
+        base = os.path.commonpath(directories)
+        return [os.path.relpath(directory, base) for directory in directories]
+
+    def load_settings(self, slug=None, skip_stages=()):
+        """
+        Load profile, settings and product catalog of the shop once for the whole run
+
+        The catalog is None when expand_sets does not run.
+        """
+        from xml_editor.models import Settings, ShopProfile
+
+        profile = ShopProfile.objects.filter(slug=slug).first() if slug else ShopProfile.get_default()
+        if profile is None:
+            raise CommandError(f'Shop profile not found: {slug}')
+        try:
+            settings = Settings.get_order_settings(profile)
+        except Settings.DoesNotExist as e:
+            raise CommandError(str(e))
+
+        if not needs_catalog(settings, skip_stages):
+            return profile, settings, None
+        xml_feed = fetch_and_parse_xml_feed(settings['feed_url'], settings['hash'])
+        if xml_feed is None:
+            raise CommandError('Could not load the product feed')
+        return profile, settings, ProductCatalog(xml_feed)
+
+    def handle(self, *args, **options):
+        files = self.collect_files(options['inputs'])
+        if not files:
+            raise CommandError('No XML files found')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+
+        worker_options = {
+            'mode': options['mode'],
+            'output_dir': options['output_dir'],
+            'settings': None,
+            'catalog': None,
+            'skip_stages': options['skip_stages'],
+            'claims': None,
+        }
+        profile = None
+        if options['mode'] == 'orders':
+            profile, worker_options['settings'], worker_options['catalog'] = self.load_settings(options['profile'], options['skip_stages'])
+
+        executor_class = ProcessPoolExecutor if options['executor'] == 'process' else ThreadPoolExecutor
+        workers = min(options['workers'], len(files))
+
+        failures = []
+        total_bytes = 0
+        totals = {}
+        timings = {}
+        run = RunRecorder(options['mode'], 'cli', profile)
+        run.catalog = worker_options['catalog']
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            # output paths written so far, shared by all workers
+            if options['executor'] == 'process':
+                worker_options['claims'] = stack.enter_context(multiprocessing.Manager()).dict()
+            else:
+                worker_options['claims'] = {}
+            executor = stack.enter_context(
+                executor_class(max_workers=workers, initializer=_init_worker, initargs=(worker_options,))
+            )
+            futures = [
+                executor.submit(_process_file, path, subdir)
+                for path, subdir in zip(files, self.output_subdirs(files))
+            ]
+            for future in as_completed(futures):
+                path, size, error, stats = future.result()
+                total_bytes += size
+                for key, value in stats.pop('timings', {}).items():
+                    timings[key] = timings.get(key, 0.0) + value
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0) + value
+                if error is not None:
+                    failures.append((path, error))
+                    self.stderr.write(f'FAILED {path}: {error}')
+                elif options['verbosity'] > 1:
+                    self.stdout.write(f'OK {path}')
+        elapsed = time.perf_counter() - start
+
+        # the whole invocation is recorded as one run
+        run.input_bytes = total_bytes
+        run.documents = totals.pop('documents', 0)
+        run.stats = dict(totals, timings=timings)
+        run.finish(f'{len(failures)} file(s) failed' if failures else None)
+
+        processed = len(files) - len(failures)
+        self.stdout.write(
+            f'Processed {processed}/{len(files)} files ({total_bytes / 1_000_000:.2f} MB) '
+            f'in {elapsed:.2f} s using {workers} {options["executor"]} worker(s)'
+        )
+        if elapsed > 0:
+            self.stdout.write(
+                f'Throughput: {len(files) / elapsed:.2f} files/s, {total_bytes / 1_000_000 / elapsed:.2f} MB/s'
+            )
+        if options['mode'] == 'orders':
+            hits = totals.get('set_cache_hits', 0)
+            misses = totals.get('set_cache_misses', 0)
+            hit_rate = hits / (hits + misses) * 100 if hits + misses else 0
+            self.stdout.write(
+                f'Sets expanded: {totals.get("sets_expanded", 0)}, '
+                f'set cache: {hits} hits, {misses} misses ({hit_rate:.1f} % hit rate), '
+                f'unmatched codes: {totals.get("unmatched_codes", 0)}'
+            )
+            if timings:
+                self.stdout.write('Stage time (sum over files): ' + ', '.join(
+                    f'{name} {seconds:.3f} s' for name, seconds in timings.items()
+                ))
+        if failures:
+            self.stderr.write(self.style.ERROR(f'{len(failures)} file(s) failed:'))
+            for path, error in sorted(failures):
+                self.stderr.write(f'  {path}: {error}')
+            raise CommandError('Some files could not be processed')
+        self.stdout.write(self.style.SUCCESS('All files processed'))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from xml_editor.history import prune_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Roll up processing runs older than RUN_HISTORY_RETENTION_DAYS into daily totals '
+        'and delete daily totals older than RUN_HISTORY_DAILY_RETENTION_DAYS'
+    )
+
+    def handle(self, *args, **options):
+        rolled_up, deleted = prune_history()
+        self.stdout.write(
+            f'Rolled up {rolled_up} run(s) older than {settings.RUN_HISTORY_RETENTION_DAYS} days, '
+            f'deleted {deleted} daily total(s) older than {settings.RUN_HISTORY_DAILY_RETENTION_DAYS} days'
+        )
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_default_profile(apps, schema_editor):
+    ShopProfile = apps.get_model('xml_editor', 'ShopProfile')
+    Settings = apps.get_model('xml_editor', 'Settings')
+    if Settings.objects.exists() and not ShopProfile.objects.exists():
+        profile = ShopProfile.objects.create(name='Výchozí', slug='default')
+        Settings.objects.update(profile=profile)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xml_editor', '0002_alter_settings_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Shop profile',
+                'verbose_name_plural': 'Shop profiles',
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='settings',
+            name='profile',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='settings', to='xml_editor.shopprofile'),
+        ),
+        migrations.RunPython(create_default_profile, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='settings',
+            name='profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='settings', to='xml_editor.shopprofile'),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='code',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='settings',
+            constraint=models.UniqueConstraint(fields=('profile', 'code'), name='unique_setting_code_per_profile'),
+        ),
+    ]
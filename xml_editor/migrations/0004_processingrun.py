@@ -0,0 +1,69 @@
+# Generated by Django 4.2.20 on 2026-10-19 05:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xml_editor', '0003_shopprofile_settings_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingRunDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('orders', 'Orders'), ('receipts', 'Receipts')], max_length=20)),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('failed_runs', models.PositiveIntegerField(default=0)),
+                ('input_bytes', models.PositiveBigIntegerField(default=0)),
+                ('documents', models.PositiveIntegerField(default=0)),
+                ('invoices', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('sets_expanded', models.PositiveIntegerField(default=0)),
+                ('unmatched_codes', models.PositiveIntegerField(default=0)),
+                ('duration', models.FloatField(default=0, help_text='Sum of run durations in seconds')),
+                ('max_duration', models.FloatField(default=0)),
+                ('profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_runs', to='xml_editor.shopprofile')),
+            ],
+            options={
+                'verbose_name': 'Processing run (daily)',
+                'verbose_name_plural': 'Processing runs (daily)',
+                'ordering': ('-date',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ProcessingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('kind', models.CharField(choices=[('orders', 'Orders'), ('receipts', 'Receipts')], max_length=20)),
+                ('source', models.CharField(choices=[('web', 'Web form'), ('stream', 'Web form with progress'), ('async', 'Async web form'), ('api', 'API'), ('cli', 'Command line')], max_length=20)),
+                ('success', models.BooleanField(default=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('input_bytes', models.PositiveBigIntegerField(default=0)),
+                ('documents', models.PositiveIntegerField(default=0)),
+                ('invoices', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('sets_expanded', models.PositiveIntegerField(default=0)),
+                ('unmatched_codes', models.PositiveIntegerField(default=0)),
+                ('duration', models.FloatField(help_text='Seconds')),
+                ('stage_timings', models.JSONField(blank=True, default=dict)),
+                ('process_peak_memory', models.PositiveBigIntegerField(blank=True, help_text='Peak RSS of the worker process since it started (not of this run), in bytes', null=True)),
+                ('catalog_version', models.CharField(blank=True, max_length=40)),
+                ('profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='xml_editor.shopprofile')),
+            ],
+            options={
+                'verbose_name': 'Processing run',
+                'verbose_name_plural': 'Processing runs',
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='processingrundaily',
+            constraint=models.UniqueConstraint(fields=('date', 'kind', 'profile'), name='unique_daily_run_per_kind_profile'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-19 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xml_editor', '0004_processingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingrun',
+            name='set_cache_hits',
+            field=models.PositiveIntegerField(default=0, help_text='Sets expanded from the catalog memo'),
+        ),
+        migrations.AddField(
+            model_name='processingrun',
+            name='set_cache_misses',
+            field=models.PositiveIntegerField(default=0, help_text='Sets expanded from the feed and memoized'),
+        ),
+        migrations.AddField(
+            model_name='processingrundaily',
+            name='set_cache_hits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processingrundaily',
+            name='set_cache_misses',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,14 +1,142 @@
 from django.db import models
 
+# Codes of the settings used by process_orders_xml
+ORDER_SETTING_CODES = (
+    'bank_id', 'account_no', 'bank_code', 'const_symbol',
+    'store_id', 'feed_url', 'hash', 'eur_rate',
+)
+
+class ShopProfile(models.Model):
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(max_length=100, unique=True)
+
+    class Meta:
+        verbose_name = "Shop profile"
+        verbose_name_plural = "Shop profiles"
+        ordering = ('name',)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def get_default(cls):
+        """Return the oldest profile, used when no profile is selected"""
+        return cls.objects.order_by('pk').first()
+
+    def copy_settings_from(self, other):
+        """Create settings missing in this profile with the values of another profile"""
+        existing = set(self.settings.values_list('code', flat=True))
+        Settings.objects.bulk_create([
+            Settings(profile=self, name=setting.name, code=setting.code, value=setting.value, category=setting.category)
+            for setting in other.settings.exclude(code__in=existing)
+        ])
+
+
 class Settings(models.Model):
+    profile = models.ForeignKey(ShopProfile, on_delete=models.CASCADE, related_name='settings')
     name = models.CharField(max_length=255)
-    code = models.CharField(max_length=100, unique=True)
+    code = models.CharField(max_length=100)
     value = models.CharField(max_length=255)
     category = models.CharField(max_length=100)
     
     class Meta:
         verbose_name = "Setting"
         verbose_name_plural = "Settings"
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'code'], name='unique_setting_code_per_profile'),
+        ]
         
     def __str__(self):
-        return f"{self.name} ({self.category})"
\ No newline at end of file
+        return f"{self.name} ({self.category})"
+
+    @classmethod
+    def as_dict(cls, profile):
+        """Return all settings of the profile as a {code: value} dictionary loaded with a single query"""
+        return dict(cls.objects.filter(profile=profile).values_list('code', 'value'))
+
+    @classmethod
+    def get_order_settings(cls, profile):
+        """
+        Return the settings of the profile needed by process_orders_xml
+
+        Raises:
+            Settings.DoesNotExist: If any of the order settings is missing
+        """
+        values = cls.as_dict(profile)
+        missing = [code for code in ORDER_SETTING_CODES if code not in values]
+        if missing:
+            raise cls.DoesNotExist(f"Missing settings: {', '.join(missing)}")
+        return {code: values[code] for code in ORDER_SETTING_CODES}
+
+
+class ProcessingRun(models.Model):
+    KIND_CHOICES = (
+        ('orders', 'Orders'),
+        ('receipts', 'Receipts'),
+    )
+    SOURCE_CHOICES = (
+        ('web', 'Web form'),
+        ('stream', 'Web form with progress'),
+        ('async', 'Async web form'),
+        ('api', 'API'),
+        ('cli', 'Command line'),
+    )
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    profile = models.ForeignKey(ShopProfile, null=True, blank=True, on_delete=models.SET_NULL, related_name='runs')
+    success = models.BooleanField(default=True)
+    error = models.CharField(max_length=255, blank=True)
+    input_bytes = models.PositiveBigIntegerField(default=0)
+    documents = models.PositiveIntegerField(default=0)
+    invoices = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    sets_expanded = models.PositiveIntegerField(default=0)
+    unmatched_codes = models.PositiveIntegerField(default=0)
+    set_cache_hits = models.PositiveIntegerField(default=0, help_text='Sets expanded from the catalog memo')
+    set_cache_misses = models.PositiveIntegerField(default=0, help_text='Sets expanded from the feed and memoized')
+    duration = models.FloatField(help_text='Seconds')
+    stage_timings = models.JSONField(default=dict, blank=True)
+    process_peak_memory = models.PositiveBigIntegerField(
+        null=True, blank=True, help_text='Peak RSS of the worker process since it started (not of this run), in bytes'
+    )
+    catalog_version = models.CharField(max_length=40, blank=True)
+
+    class Meta:
+        verbose_name = "Processing run"
+        verbose_name_plural = "Processing runs"
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.created:%Y-%m-%d %H:%M} ({self.duration:.2f} s)"
+
+
+class ProcessingRunDaily(models.Model):
+    """Daily totals of processing runs removed by the retention policy"""
+    date = models.DateField()
+    kind = models.CharField(max_length=20, choices=ProcessingRun.KIND_CHOICES)
+    profile = models.ForeignKey(ShopProfile, null=True, blank=True, on_delete=models.SET_NULL, related_name='daily_runs')
+    runs = models.PositiveIntegerField(default=0)
+    failed_runs = models.PositiveIntegerField(default=0)
+    input_bytes = models.PositiveBigIntegerField(default=0)
+    documents = models.PositiveIntegerField(default=0)
+    invoices = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    sets_expanded = models.PositiveIntegerField(default=0)
+    unmatched_codes = models.PositiveIntegerField(default=0)
+    set_cache_hits = models.PositiveIntegerField(default=0)
+    set_cache_misses = models.PositiveIntegerField(default=0)
+    duration = models.FloatField(default=0, help_text='Sum of run durations in seconds')
+    max_duration = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Processing run (daily)"
+        verbose_name_plural = "Processing runs (daily)"
+        ordering = ('-date',)
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'kind', 'profile'], name='unique_daily_run_per_kind_profile'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.date} ({self.runs} runs)"
@@ -0,0 +1,282 @@
+import time
+
+from .catalog import CatalogUnavailable, ProductCatalog
+from .utils import (
+    PROGRESS_INTERVAL,
+    add_element,
+    create_invoice_item_foreign_currency,
+    create_invoice_item_home_currency,
+    delete_element,
+    fetch_and_parse_xml_feed,
+)
+
+
+class OrderContext:
+    """
+    State of one orders XML run shared by all pipeline stages
+
+    Args:
+        root: XML root element
+        bank_id (str): Bank ID
+        account_no (str): Account number
+        bank_code (str): Bank code
+        const_symbol (str): Symbol constant
+        store_id (str): Store ID
+        feed_url (str): URL of the XML feed
+        hash (str): Hash for authentication
+        eur_rate (float): EUR exchange rate
+        xml_feed (ProductCatalog/list, optional): Already loaded product catalog or feed, fetched from feed_url when needed
+        stats (dict, optional): Counters of the run, stage timings are stored under 'timings'
+        progress (callable, optional): Called as progress(stage, processed, total) while the stages run
+    """
+
+    def __init__(self, root, bank_id=None, account_no=None, bank_code=None, const_symbol=None, store_id=None,
+                 feed_url=None, hash=None, eur_rate=None, xml_feed=None, stats=None, progress=None):
+        self.root = root
+        self.bank_id = bank_id
+        self.account_no = account_no
+        self.bank_code = bank_code
+        self.const_symbol = const_symbol
+        self.store_id = store_id
+        self.feed_url = feed_url
+        self.hash = hash
+        self.eur_rate = eur_rate
+        self.xml_feed = xml_feed
+        self.stats = stats if stats is not None else {}
+        self.timings = self.stats.setdefault('timings', {})
+        self.progress = progress
+        self.namespaces = {
+            'dat': root.nsmap['dat'],
+            'inv': root.nsmap['inv'],
+            'typ': root.nsmap['typ']
+        }
+        self._catalog = xml_feed if isinstance(xml_feed, ProductCatalog) else None
+        self.count('invoices', len(root.findall('.//inv:invoice', self.namespaces)))
+        self.count('items', len(self.invoice_items()))
+
+    @property
+    def catalog(self):
+        """
+        Product catalog, the feed is loaded on first use
+
+        Callers that load the catalog themselves (see needs_catalog) pass it
+        as xml_feed and fail on their own when it is unavailable.
+
+        Raises:
+            CatalogUnavailable: If the feed could not be loaded
+        """
+        if self._catalog is None:
+            if self.xml_feed is None:
+                self.xml_feed = fetch_and_parse_xml_feed(self.feed_url, self.hash)
+                if self.xml_feed is None:
+                    raise CatalogUnavailable()
+            self._catalog = ProductCatalog(self.xml_feed)
+        return self._catalog
+
+    def invoice_items(self):
+        return self.root.findall('.//inv:invoiceItem', self.namespaces)
+
+    def count(self, key, value=1):
+        self.stats[key] = self.stats.get(key, 0) + value
+
+    def report(self, stage, processed, total):
+        # report every PROGRESS_INTERVAL elements and at the end of the stage
+        if self.progress is not None and (processed % PROGRESS_INTERVAL == 0 or processed == total):
+            self.progress(stage, processed, total)
+
+
+class Stage:
+    """Named pipeline step, skipped when applies(context) is false"""
+
+    def __init__(self, name, func, applies=None):
+        self.name = name
+        self.func = func
+        self.applies = applies
+
+    def __call__(self, context):
+        return self.func(context)
+
+    def can_apply(self, context):
+        return self.applies is None or self.applies(context)
+
+
+# Registered stages in the order they run
+STAGES = {}
+
+
+def stage(name, applies=None):
+    """Register function as a pipeline stage"""
+    def decorator(func):
+        STAGES[name] = Stage(name, func, applies)
+        return func
+    return decorator
+
+
+def is_set(value):
+    return value not in (None, '')
+
+
+@stage('strip_codes')
+def strip_codes(context):
+    """Remove inv:code only for shipping and billing items"""
+    invoice_items = context.invoice_items()
+    context.report('strip_codes', 0, len(invoice_items))
+    for index, invoice_item in enumerate(invoice_items, 1):
+        code_elem = invoice_item.find('inv:code', context.namespaces)
+        if code_elem is not None:
+            code_value = code_elem.text
+            if code_value and ('SHIPPING' in code_value or 'BILLING' in code_value):
+                delete_element(invoice_item, code_elem)
+        context.report('strip_codes', index, len(invoice_items))
+
+
+@stage('expand_sets', applies=lambda context: context.xml_feed is not None or is_set(context.feed_url))
+def expand_sets(context):
+    """Replace set items (stockItem ids joined by underscore) with their components from the feed"""
+    namespaces = context.namespaces
+    invoice_items = context.invoice_items()
+    for index, inv_item in enumerate(invoice_items):
+        context.report('expand_sets', index, len(invoice_items))
+        stock_item = inv_item.find('inv:stockItem', namespaces)
+        # check if stockItem exists
+        if stock_item is None:
+            continue
+        # check if stockItem ids contains underscore
+        stock_item = stock_item.find('typ:stockItem', namespaces)
+        stock_item_ids = stock_item.find('typ:ids', namespaces)
+        if stock_item_ids is None or '_' not in stock_item_ids.text:
+            continue
+
+        home_currency = inv_item.find('inv:homeCurrency', namespaces)
+        foreign_currency = inv_item.find('inv:foreignCurrency', namespaces)
+        quantity = inv_item.find('inv:quantity', namespaces)
+        invoice = inv_item.getparent()
+        delete_element(invoice, inv_item)
+
+        if home_currency is not None:
+            currency = 'home'
+            create_invoice_item = create_invoice_item_home_currency
+        elif foreign_currency is not None:
+            currency = 'foreign'
+            create_invoice_item = create_invoice_item_foreign_currency
+        else:
+            continue
+
+        # components of the set are resolved once per catalog, currency and rate
+        components = context.catalog.expand_bundle(stock_item_ids.text, currency, context.eur_rate, context.stats)
+        context.count('sets_expanded')
+        context.count('items_expanded', len(components))
+        for component in components:
+            # create new invoiceItem and add it to invoice
+            item_data = dict(component, quantity=quantity.text)
+            new_inv_el = create_invoice_item(context.root, item_data)
+            invoice.append(new_inv_el)
+    context.report('expand_sets', len(invoice_items), len(invoice_items))
+
+
+def _update_unit_price(invoice_item, currency_elem, namespaces):
+    price_elem = currency_elem.find('typ:price', namespaces)
+    price_vat_elem = currency_elem.find('typ:priceVAT', namespaces)
+    unit_price_elem = currency_elem.find('typ:unitPrice', namespaces)
+    pay_vat_elem = invoice_item.find('inv:payVAT', namespaces)
+
+    if all([price_elem is not None, price_vat_elem is not None, unit_price_elem is not None]):
+        try:
+            price = float(price_elem.text)
+            price_vat = float(price_vat_elem.text)
+            new_unit_price = price + price_vat
+            unit_price_elem.text = f"{new_unit_price:.2f}"
+            pay_vat_elem.text = 'true'
+        except (ValueError, TypeError) as e:
+            print(f"Error processing prices: {e}")
+
+
+@stage('recompute_prices')
+def recompute_prices(context):
+    """Set unitPrice to the sum of price and priceVAT and payVAT to true in both currencies"""
+    invoice_items = context.invoice_items()
+    context.report('recompute_prices', 0, len(invoice_items))
+    for index, invoice_item in enumerate(invoice_items, 1):
+        home_currency = invoice_item.find('inv:homeCurrency', context.namespaces)
+        if home_currency is not None:
+            _update_unit_price(invoice_item, home_currency, context.namespaces)
+        foreign_currency = invoice_item.find('inv:foreignCurrency', context.namespaces)
+        if foreign_currency is not None:
+            _update_unit_price(invoice_item, foreign_currency, context.namespaces)
+        context.report('recompute_prices', index, len(invoice_items))
+
+
+@stage('assign_store', applies=lambda context: is_set(context.store_id))
+def assign_store(context):
+    """Add store subelement to every stockItem"""
+    for invoice_item in context.invoice_items():
+        stock_item = invoice_item.find('inv:stockItem', context.namespaces)
+        if stock_item is not None:
+            store_elem = add_element(stock_item, 'typ:store')
+            add_element(store_elem, 'typ:ids', context.store_id)
+
+
+@stage('bank_account', applies=lambda context: is_set(context.bank_id))
+def bank_account(context):
+    """Add bank account and symConst to the header of EUR invoices"""
+    namespaces = context.namespaces
+    invoices = context.root.findall('.//inv:invoice', namespaces)
+    context.report('bank_account', 0, len(invoices))
+    for index, invoice in enumerate(invoices, 1):
+        invoice_header = invoice.find('inv:invoiceHeader', namespaces)
+        invoice_summary = invoice.find('inv:invoiceSummary', namespaces)
+        if invoice_summary is not None:
+            currency_id_elem = invoice_summary.find('inv:foreignCurrency/typ:currency/typ:ids', namespaces)
+            if currency_id_elem is not None and currency_id_elem.text == 'EUR':
+                account_elem = add_element(invoice_header, 'inv:account')
+                add_element(account_elem, 'typ:ids', context.bank_id)
+                add_element(account_elem, 'typ:accountNo', context.account_no)
+                add_element(account_elem, 'typ:bankCode', context.bank_code)
+                if context.const_symbol is not None:
+                    add_element(invoice_header, 'inv:symConst', context.const_symbol)
+        context.report('bank_account', index, len(invoices))
+
+
+def needs_catalog(order_settings, skip=()):
+    """
+    Return whether expand_sets will run and use the product catalog
+
+    Lets callers skip loading the feed when it would not be used.
+
+    Args:
+        order_settings (dict): Settings of the run, see OrderContext
+        skip (iterable, optional): Names of the stages to skip
+    """
+    return 'expand_sets' not in skip and is_set(order_settings.get('feed_url'))
+
+
+def run_pipeline(context, stages=None, skip=()):
+    """
+    Run pipeline stages on the context and time each of them
+
+    Stages that cannot apply (e.g. assign_store without store_id) are
+    skipped before they touch the document.
+
+    Args:
+        context (OrderContext): State of the run
+        stages (list, optional): Names of the stages to run, all registered stages by default
+        skip (iterable, optional): Names of the stages to skip
+
+    Returns:
+        list: Names of the stages that ran
+    """
+    names = list(STAGES) if stages is None else list(stages)
+    unknown = [name for name in [*names, *skip] if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown pipeline stages: {', '.join(unknown)}")
+
+    executed = []
+    for name in names:
+        pipeline_stage = STAGES[name]
+        if name in skip or not pipeline_stage.can_apply(context):
+            continue
+        start = time.perf_counter()
+        pipeline_stage(context)
+        context.timings[name] = context.timings.get(name, 0.0) + time.perf_counter() - start
+        executed.append(name)
+    return executed
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import queue
+import threading
+
+from django.db import connections
+
+from .catalog import CatalogUnavailable, get_catalog
+from .pipeline import needs_catalog
+from .uploads import open_xml_sources, prefixed_name
+from .utils import process_orders_xml
+
+# Seconds without progress after which a keep-alive comment is sent
+KEEPALIVE_INTERVAL = 15
+
+STAGE_LABELS = {
+    'parse': 'Načítání XML',
+    'strip_codes': 'Odstranění kódů dopravy a platby',
+    'expand_sets': 'Rozpad sad',
+    'recompute_prices': 'Přepočet cen',
+    'bank_account': 'Doplnění bankovního účtu',
+    'serialize': 'Ukládání XML',
+}
+
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def start_orders_processing(put, uploaded_file, filename, order_settings, tenant=None, on_finish=None,
+                            max_size=None, run=None):
+    """
+    Process orders XML in a background thread and pass its events to put((event, data))
+
+    None is put after the last event.
+
+    Events:
+        progress: {stage, label, processed, total, invoices, items_expanded, document}
+        result: {filename, xml}, one for every XML document of the upload
+        error: {message}
+
+    Args:
+        put (callable): Receives the events, called from the processing thread
+        uploaded_file: Uploaded XML file or archive, see open_xml_sources
+        filename (str): Name of the uploaded file
+        order_settings (dict): Settings passed to process_orders_xml
+        tenant (str, optional): Shop profile whose cached catalog is used
+        on_finish (callable, optional): Called when the processing thread ends,
+            also when the client disconnects before that
+        max_size (int, optional): Maximum size of a decompressed document
+        run (RunRecorder, optional): Records the statistics of the run
+    """
+    stats = run.stats if run is not None else {}
+    # invoices of the previous documents of an archive are kept in 'done'
+    invoices = {'processed': 0, 'done': 0}
+    current = {'document': filename}
+
+    def progress(stage, processed, total):
+        if stage == 'bank_account':
+            invoices['processed'] = invoices['done'] + processed
+        elif stage == 'serialize':
+            invoices['done'] = stats.get('invoices', 0)
+            invoices['processed'] = invoices['done']
+        put(('progress', {
+            'stage': stage,
+            'label': STAGE_LABELS.get(stage, stage),
+            'processed': processed,
+            'total': total,
+            'invoices': invoices['processed'],
+            'items_expanded': stats.get('items_expanded', 0),
+            'document': current['document'],
+        }))
+
+    def process():
+        error = None
+        try:
+            catalog = None
+            if needs_catalog(order_settings):
+                catalog = get_catalog(order_settings['feed_url'], order_settings['hash'], tenant)
+                if catalog is None:
+                    raise CatalogUnavailable()
+                if run is not None:
+                    run.catalog = catalog
+            for name, stream in open_xml_sources(uploaded_file, filename, max_size=max_size):
+                current['document'] = name
+                modified_xml = process_orders_xml(
+                    xml_data=stream,
+                    xml_feed=catalog,
+                    stats=stats,
+                    progress=progress,
+                    **order_settings
+                )
+                if modified_xml is None:
+                    error = ValueError(f'{name} není platný XML soubor')
+                    put(('error', {'message': f'Nepovedlo se zpracovat XML soubor {name}: neplatné XML.'}))
+                    break
+                if run is not None:
+                    run.documents += 1
+                put(('result', {'filename': prefixed_name('modified_', name), 'xml': modified_xml}))
+        except Exception as e:
+            error = e
+            put(('error', {'message': f'Nepovedlo se zpracovat XML soubor: {e}'}))
+        finally:
+            if run is not None:
+                run.finish(error)
+                # the thread is not managed by Django, close its database connection
+                connections.close_all()
+            if on_finish is not None:
+                on_finish()
+            put(None)
+
+    threading.Thread(target=process, daemon=True).start()
+
+
+def stream_orders_processing(*args, **kwargs):
+    """
+    Yield progress of start_orders_processing as Server-Sent Events, for WSGI
+
+    Takes the arguments of start_orders_processing except put.
+    """
+    events = queue.Queue()
+    start_orders_processing(events.put, *args, **kwargs)
+
+    while True:
+        try:
+            item = events.get(timeout=KEEPALIVE_INTERVAL)
+        except queue.Empty:
+            yield ': keep-alive\n\n'
+            continue
+        if item is None:
+            break
+        yield sse_event(*item)
+
+
+async def astream_orders_processing(*args, **kwargs):
+    """
+    Async version of stream_orders_processing, for ASGI
+
+    Django buffers a sync iterator of a streaming response completely when
+    it is served over ASGI, the events are awaited here instead.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, item)
+        except RuntimeError:
+            # the event loop was closed after the client disconnected
+            pass
+
+    start_orders_processing(put, *args, **kwargs)
+
+    while True:
+        try:
+            item = await asyncio.wait_for(events.get(), KEEPALIVE_INTERVAL)
+        except asyncio.TimeoutError:
+            yield ': keep-alive\n\n'
+            continue
+        if item is None:
+            break
+        yield sse_event(*item)
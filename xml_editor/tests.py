@@ -1,3 +1,792 @@
-from django.test import TestCase
+import gzip
+import io
+import os
+import pickle
+import threading
+import time
+import zipfile
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.session import SessionStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from lxml import etree
+import requests
+
+from authentication.models import ApiToken
+from . import async_views
+from .catalog import CatalogCache, CatalogUnavailable, ProductCatalog, clear_catalogs, get_catalog
+from .history import RunRecorder, daily_series, prune_history, rollup_runs
+from .management.commands.loadtest import Command as LoadtestCommand, percentile
+from .models import ORDER_SETTING_CODES, ProcessingRun, ProcessingRunDaily, Settings, ShopProfile
+from .pipeline import OrderContext, run_pipeline
+from .uploads import DocumentTooLarge, LimitedReader, UnsupportedUpload, open_xml_sources
+from .utils import parse_xml_to_etree, process_orders_xml
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), 'test_data')
+
+FEED = [
+    {'PRODUCT_CODE': '102246', 'PRODUCT': 'Stripes', 'PRICE': '826.45', 'PRICE_VAT': '1000', 'VAT': '21'},
+    {'PRODUCT_CODE': '100239', 'PRODUCT': 'Callin', 'PRICE': '743.80', 'PRICE_VAT': '900', 'VAT': '21'},
+]
+
+ORDER_SETTINGS = {
+    'bank_id': 'EUR1',
+    'account_no': '2001234567',
+    'bank_code': '0100',
+    'const_symbol': '0308',
+    'store_id': 'SKLAD',
+    'feed_url': 'https://feed.example/',
+    'hash': 'hash',
+    'eur_rate': '25',
+}
+
+NAMESPACES = {
+    'inv': 'http://www.stormware.cz/schema/version_2/invoice.xsd',
+    'typ': 'http://www.stormware.cz/schema/version_2/type.xsd',
+}
+
+
+def read_test_data(name):
+    with open(os.path.join(TEST_DATA, name), 'rb') as f:
+        return f.read()
+
+
+def create_profile(slug, **values):
+    """Create shop profile with all order settings, ORDER_SETTINGS overridden by values"""
+    profile = ShopProfile.objects.create(name=slug.title(), slug=slug)
+    values = {**ORDER_SETTINGS, **values}
+    Settings.objects.bulk_create([
+        Settings(profile=profile, name=code, code=code, value=values[code], category='orders')
+        for code in ORDER_SETTING_CODES
+    ])
+    return profile
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+class OrderPipelineTests(TestCase):
+    """The stage pipeline produces the output of the original transformer"""
+
+    def process(self, stats=None, **settings):
+        return process_orders_xml(
+            xml_data=read_test_data('orders.xml'), xml_feed=FEED, stats=stats, **{**ORDER_SETTINGS, **settings}
+        )
+
+    def test_output_matches_original_transformer(self):
+        # orders_expected.xml was produced by the transformer before the pipeline,
+        # it has sets in the home and the foreign currency
+        output = self.process()
+        self.assertEqual(output, read_test_data('orders_expected.xml').decode('utf-8'))
+
+    def test_home_currency_set_components(self):
+        root = etree.fromstring(self.process().encode('utf-8'))
+        items = root.findall('.//inv:invoice', NAMESPACES)[0].findall('.//inv:invoiceItem', NAMESPACES)
+        self.assertEqual([item.findtext('inv:code', namespaces=NAMESPACES) for item in items], [None, '102246', '100239'])
+        stripes = items[1]
+        self.assertEqual(stripes.findtext('inv:quantity', namespaces=NAMESPACES), '2')
+        self.assertEqual(stripes.findtext('inv:homeCurrency/typ:unitPrice', namespaces=NAMESPACES), '1000.00')
+        self.assertEqual(stripes.findtext('inv:homeCurrency/typ:price', namespaces=NAMESPACES), '826.45')
+
+    def test_foreign_currency_set_components(self):
+        root = etree.fromstring(self.process().encode('utf-8'))
+        invoice = root.findall('.//inv:invoice', NAMESPACES)[1]
+        stripes = [
+            item for item in invoice.findall('.//inv:invoiceItem', NAMESPACES)
+            if item.findtext('inv:code', namespaces=NAMESPACES) == '102246'
+        ][0]
+        # feed prices are converted with eur_rate and rounded to cents
+        self.assertEqual(stripes.findtext('inv:foreignCurrency/typ:price', namespaces=NAMESPACES), '33.06')
+        self.assertEqual(stripes.findtext('inv:foreignCurrency/typ:priceVAT', namespaces=NAMESPACES), '6.94')
+        self.assertEqual(stripes.findtext('inv:foreignCurrency/typ:unitPrice', namespaces=NAMESPACES), '40.00')
+        self.assertEqual(invoice.findtext('inv:invoiceHeader/inv:account/typ:ids', namespaces=NAMESPACES), 'EUR1')
+
+    def test_unmatched_set_components_are_left_out_and_counted(self):
+        stats = {}
+        root = etree.fromstring(self.process(stats=stats).encode('utf-8'))
+        codes = [code.text for code in root.findall('.//inv:invoiceItem/inv:code', NAMESPACES)]
+        self.assertNotIn('999999', codes)
+        self.assertNotIn('102246_999999', codes)
+        # the incomplete set is replaced by its only known component
+        self.assertEqual(codes.count('102246'), 3)
+        self.assertEqual(stats['unmatched_codes'], 1)
+        self.assertEqual(stats['sets_expanded'], 3)
+
+    def test_empty_store_and_bank_skip_their_stages(self):
+        root = parse_xml_to_etree(read_test_data('orders.xml'))
+        context = OrderContext(root, **{**ORDER_SETTINGS, 'store_id': '', 'bank_id': ''}, xml_feed=FEED)
+        executed = run_pipeline(context)
+        self.assertEqual(executed, ['strip_codes', 'expand_sets', 'recompute_prices'])
+        self.assertIsNone(root.find('.//typ:store', NAMESPACES))
+        self.assertIsNone(root.find('.//inv:account', NAMESPACES))
+
+    def test_skipped_expand_sets_does_not_load_feed(self):
+        with mock.patch('xml_editor.pipeline.fetch_and_parse_xml_feed') as fetch:
+            output = process_orders_xml(
+                xml_data=read_test_data('orders.xml'), skip_stages=['expand_sets'], **ORDER_SETTINGS
+            )
+        fetch.assert_not_called()
+        self.assertIn('<typ:ids>102246_100239</typ:ids>', output)
+
+    def test_unavailable_feed_is_not_loaded_twice(self):
+        root = parse_xml_to_etree(read_test_data('orders.xml'))
+        context = OrderContext(root, **ORDER_SETTINGS)
+        with mock.patch('xml_editor.pipeline.fetch_and_parse_xml_feed', return_value=None) as fetch:
+            with self.assertRaises(CatalogUnavailable):
+                run_pipeline(context)
+        fetch.assert_called_once()
+
+    def test_unknown_stage_is_rejected(self):
+        root = parse_xml_to_etree(read_test_data('orders.xml'))
+        with self.assertRaises(ValueError):
+            run_pipeline(OrderContext(root, **ORDER_SETTINGS, xml_feed=FEED), skip=['missing'])
+
+
+class ProductCatalogTests(TestCase):
+    """Set bundles are memoized per catalog, currency and exchange rate"""
+
+    def test_bundles_are_memoized_per_currency_and_rate(self):
+        catalog = ProductCatalog(FEED)
+        stats = {}
+        home = catalog.expand_bundle('102246_100239', 'home', '25', stats)
+        self.assertIs(catalog.expand_bundle('102246_100239', 'home', '20', stats), home)
+        catalog.expand_bundle('102246_100239', 'foreign', '25', stats)
+        catalog.expand_bundle('102246_100239', 'foreign', '25', stats)
+        self.assertEqual(stats, {'set_cache_hits': 2, 'set_cache_misses': 2})
+        self.assertEqual(catalog.cache_info()['bundles'], 2)
+        self.assertEqual([item['code'] for item in home], ['102246', '100239'])
+        self.assertEqual([item['unitPrice'] for item in home], [1000.0, 900.0])
+
+    def test_unmatched_codes_are_counted_on_every_use(self):
+        catalog = ProductCatalog(FEED)
+        stats = {}
+        for _ in range(3):
+            items = catalog.expand_bundle('102246_999999_888888', 'home', stats=stats)
+        self.assertEqual([item['code'] for item in items], ['102246'])
+        self.assertEqual(stats, {'set_cache_hits': 2, 'set_cache_misses': 1, 'unmatched_codes': 6})
+        self.assertEqual((catalog.hits, catalog.misses), (2, 1))
+
+    def test_concurrent_misses_are_memoized_once(self):
+        catalog = ProductCatalog(FEED)
+        component_item_data = catalog._component_item_data
+
+        def slow_component_item_data(*args):
+            # widen the window between the lookup and the insert
+            time.sleep(0.01)
+            return component_item_data(*args)
+
+        barrier = threading.Barrier(8)
+
+        def expand():
+            barrier.wait()
+            catalog.expand_bundle('102246_100239', 'home')
+
+        with mock.patch.object(catalog, '_component_item_data', slow_component_item_data):
+            threads = [threading.Thread(target=expand) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual((catalog.hits, catalog.misses), (7, 1))
+        (_, _, size), = catalog._bundles.values()
+        self.assertEqual(catalog.bundles_size, size)
+
+    def test_new_exchange_rate_drops_foreign_bundles(self):
+        catalog = ProductCatalog(FEED)
+        catalog.expand_bundle('102246_100239', 'home')
+        catalog.expand_bundle('102246_100239', 'foreign', '25')
+        catalog.expand_bundle('102246', 'foreign', '25')
+        self.assertEqual(len(catalog._bundles), 3)
+
+        items = catalog.expand_bundle('102246_100239', 'foreign', '20')
+        self.assertEqual(items[0]['unitPrice'], 50.0)
+        self.assertEqual(
+            sorted(catalog._bundles), [('102246_100239', 'foreign', '20'), ('102246_100239', 'home', None)]
+        )
+        self.assertEqual(catalog.bundles_size, sum(size for _, _, size in catalog._bundles.values()))
+        self.assertEqual(catalog.size, catalog.feed_size + catalog.bundles_size)
+
+    def test_catalog_can_be_pickled(self):
+        catalog = ProductCatalog(FEED)
+        catalog.expand_bundle('102246_100239', 'home')
+        copy = pickle.loads(pickle.dumps(catalog))
+        self.assertEqual(copy.expand_bundle('102246_100239', 'home'), catalog.expand_bundle('102246_100239', 'home'))
+        self.assertEqual(copy.hits, 1)
+
+
+class CatalogCacheTests(TestCase):
+    """Cached catalogs expire after the TTL and the least recently used ones are evicted"""
+
+    def catalog(self, code):
+        return ProductCatalog([dict(FEED[0], PRODUCT_CODE=code)])
+
+    def test_ttl(self):
+        cache = CatalogCache()
+        catalog = self.catalog('1')
+        with mock.patch('xml_editor.catalog.time.monotonic', return_value=100.0):
+            cache.put('a', catalog, max_bytes=10_000)
+        with mock.patch('xml_editor.catalog.time.monotonic', return_value=159.0):
+            self.assertEqual(cache.get('a', ttl=60, max_bytes=10_000), (catalog, catalog))
+        with mock.patch('xml_editor.catalog.time.monotonic', return_value=160.0):
+            # an expired catalog is returned as stale, so an unchanged feed keeps its memo
+            self.assertEqual(cache.get('a', ttl=60, max_bytes=10_000), (None, catalog))
+        self.assertEqual(cache.get('b', ttl=60, max_bytes=10_000), (None, None))
+
+    def test_least_recently_used_catalog_is_evicted(self):
+        cache = CatalogCache()
+        a, b, c = self.catalog('1'), self.catalog('2'), self.catalog('3')
+        max_bytes = a.size * 2
+        cache.put('a', a, max_bytes)
+        cache.put('b', b, max_bytes)
+        cache.get('a', 60, max_bytes)
+        cache.put('c', c, max_bytes)
+        self.assertEqual(cache.get('b', 60, max_bytes), (None, None))
+        self.assertEqual(cache.get('a', 60, max_bytes), (a, a))
+        self.assertEqual(cache.get('c', 60, max_bytes), (c, c))
+        self.assertEqual(cache.info()['evictions'], 1)
+
+    def test_growing_memo_evicts_on_lookup(self):
+        cache = CatalogCache()
+        a, b = ProductCatalog(FEED), ProductCatalog(FEED[:1])
+        max_bytes = a.size + b.size
+        cache.put('a', a, max_bytes)
+        cache.put('b', b, max_bytes)
+        b.expand_bundle('102246_102246', 'home')
+        cache.get('b', 60, max_bytes)
+        self.assertEqual(cache.get('a', 60, max_bytes), (None, None))
+
+    def test_most_recent_catalog_is_kept_over_the_limit(self):
+        cache = CatalogCache()
+        catalog = self.catalog('1')
+        cache.put('a', catalog, max_bytes=1)
+        self.assertEqual(cache.get('a', 60, max_bytes=1), (catalog, catalog))
+
+
+@override_settings(CATALOG_CACHE_TTL=300, CATALOG_CACHE_MAX_BYTES=10_000_000)
+class TenantCatalogTests(TestCase):
+    """Every shop profile has its own cached catalog"""
+
+    def setUp(self):
+        clear_catalogs()
+        self.addCleanup(clear_catalogs)
+
+    def test_tenants_do_not_share_catalogs(self):
+        with mock.patch('xml_editor.catalog.fetch_and_parse_xml_feed', return_value=FEED) as fetch:
+            first = get_catalog('https://feed.example/', 'hash', 'first')
+            second = get_catalog('https://feed.example/', 'hash', 'second')
+            self.assertIs(get_catalog('https://feed.example/', 'hash', 'first'), first)
+        self.assertIsNot(first, second)
+        self.assertEqual(fetch.call_count, 2)
+        first.expand_bundle('102246_100239', 'home')
+        self.assertEqual(second.cache_info()['bundles'], 0)
+
+    def test_unchanged_feed_keeps_memoized_bundles(self):
+        with mock.patch('xml_editor.catalog.fetch_and_parse_xml_feed', side_effect=[FEED, FEED, FEED[:1]]):
+            with mock.patch('xml_editor.catalog.time.monotonic', return_value=0.0):
+                catalog = get_catalog('https://feed.example/', 'hash', 'shop')
+            with mock.patch('xml_editor.catalog.time.monotonic', return_value=300.0):
+                self.assertIs(get_catalog('https://feed.example/', 'hash', 'shop'), catalog)
+            with mock.patch('xml_editor.catalog.time.monotonic', return_value=600.0):
+                changed = get_catalog('https://feed.example/', 'hash', 'shop')
+        self.assertIsNot(changed, catalog)
+        self.assertNotEqual(changed.version, catalog.version)
+
+    def test_unavailable_feed_is_not_cached(self):
+        with mock.patch('xml_editor.catalog.fetch_and_parse_xml_feed', side_effect=[None, FEED]):
+            self.assertIsNone(get_catalog('https://feed.example/', 'hash', 'shop'))
+            self.assertIsNotNone(get_catalog('https://feed.example/', 'hash', 'shop'))
+
+
+class DefaultProfileMigrationTests(TransactionTestCase):
+    """Migration 0003 moves existing settings to a default shop profile"""
+
+    before = [('xml_editor', '0002_alter_settings_value')]
+    after = [('xml_editor', '0003_shopprofile_settings_profile')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_settings_are_moved_to_default_profile(self):
+        apps = self.migrate(self.before)
+        OldSettings = apps.get_model('xml_editor', 'Settings')
+        OldSettings.objects.create(name='Sklad', code='store_id', value='SKLAD', category='orders')
+        OldSettings.objects.create(name='Kurz', code='eur_rate', value='25', category='orders')
+
+        apps = self.migrate(self.after)
+        profile = apps.get_model('xml_editor', 'ShopProfile').objects.get()
+        self.assertEqual((profile.slug, profile.name), ('default', 'Výchozí'))
+        settings = apps.get_model('xml_editor', 'Settings').objects.all()
+        self.assertEqual(sorted(settings.values_list('code', 'profile__slug')), [
+            ('eur_rate', 'default'), ('store_id', 'default'),
+        ])
+
+    def test_empty_database_gets_no_profile(self):
+        self.migrate(self.before)
+        apps = self.migrate(self.after)
+        self.assertFalse(apps.get_model('xml_editor', 'ShopProfile').objects.exists())
+
+
+class ApiAuthenticationTests(TestCase):
+    """The API accepts only active tokens of active users"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('api', password='api-password')
+        self.token = ApiToken.objects.create(user=self.user, name='test')
+
+    def post(self, authorization=None, **extra):
+        if authorization is not None:
+            extra['HTTP_AUTHORIZATION'] = authorization
+        return self.client.post(
+            reverse('api_receipts'), read_test_data('receipt.xml'), content_type='application/xml', **extra
+        )
+
+    def assertError(self, response, status, code):
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response.json()['errors'][0]['code'], code)
+
+    def test_valid_token(self):
+        response = self.post(f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'100239', response.content)
+
+    def test_missing_token(self):
+        self.assertError(self.post(), 401, 'not_authenticated')
+        self.assertError(self.post(f'Bearer {self.token.key}'), 401, 'not_authenticated')
+
+    def test_unknown_token(self):
+        self.assertError(self.post('Token 0123456789abcdef'), 401, 'invalid_token')
+
+    def test_inactive_token(self):
+        self.token.is_active = False
+        self.token.save()
+        self.assertError(self.post(f'Token {self.token.key}'), 401, 'invalid_token')
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertError(self.post(f'Token {self.token.key}'), 401, 'invalid_token')
+
+    def test_session_login_is_not_enough(self):
+        self.client.force_login(self.user)
+        self.assertError(self.post(), 401, 'not_authenticated')
+
+    def test_only_post_is_allowed(self):
+        response = self.client.get(reverse('api_receipts'), HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 405)
+
+
+class CountingStream(io.BytesIO):
+    """Stream remembering how many bytes were read from it"""
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class UploadTests(TestCase):
+    """Compressed uploads are decompressed lazily and within the size limit"""
+
+    def names(self, data, filename, **kwargs):
+        return [name for name, _ in open_xml_sources(io.BytesIO(data), filename, **kwargs)]
+
+    def test_limited_reader_stops_at_limit(self):
+        stream = CountingStream(b'x' * 1_000_000)
+        with self.assertRaises(DocumentTooLarge):
+            LimitedReader(stream, 1000).read()
+        self.assertEqual(stream.bytes_read, 1001)
+
+    def test_limited_reader_reads_document_within_limit(self):
+        self.assertEqual(LimitedReader(io.BytesIO(b'x' * 1000), 1000).read(), b'x' * 1000)
+
+    def test_gzip_document(self):
+        sources = list(open_xml_sources(io.BytesIO(gzip.compress(read_test_data('receipt.xml'))), 'receipt.xml.gz'))
+        self.assertEqual([name for name, _ in sources], ['receipt.xml'])
+        self.assertEqual(sources[0][1].read(), read_test_data('receipt.xml'))
+
+    def test_gzip_bomb_is_rejected(self):
+        data = gzip.compress(b'<a>' + b' ' * 10_000_000 + b'</a>')
+        (_, stream), = open_xml_sources(io.BytesIO(data), 'bomb.xml.gz', max_size=100_000)
+        with self.assertRaises(DocumentTooLarge):
+            stream.read()
+
+    def test_zip_members_keep_folders(self):
+        data = make_zip([
+            ('x/one.xml', b'<a/>'),
+            ('y/one.xml', b'<a/>'),
+            ('../one.xml', b'<a/>'),
+            ('/one.xml', b'<a/>'),
+            ('readme.txt', b'text'),
+            ('__MACOSX/x/._one.xml', b''),
+        ])
+        self.assertEqual(self.names(data, 'orders.zip'), ['x/one.xml', 'y/one.xml', 'one.xml', 'one_2.xml'])
+
+    def test_zip_without_xml_is_rejected(self):
+        with self.assertRaises(UnsupportedUpload):
+            self.names(make_zip([('readme.txt', b'text')]), 'orders.zip')
+
+    def test_unsupported_upload(self):
+        with self.assertRaises(UnsupportedUpload):
+            self.names(b'data', 'orders.rar')
+        with self.assertRaises(UnsupportedUpload):
+            self.names(b'data', 'orders.xml', content_encoding='br')
+
+
+class ApiUploadTests(TestCase):
+    """The API decompresses request bodies and reports oversized or broken ones"""
+
+    def setUp(self):
+        self.token = ApiToken.objects.create(user=User.objects.create_user('api'), name='test')
+
+    def post(self, body, content_type='application/xml', **extra):
+        return self.client.post(
+            reverse('api_receipts'), body, content_type=content_type,
+            HTTP_AUTHORIZATION=f'Token {self.token.key}', **extra
+        )
+
+    def test_gzip_content_encoding(self):
+        response = self.post(gzip.compress(read_test_data('receipt.xml')), HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+
+    def test_zip_returns_archive_with_unique_names(self):
+        receipt = read_test_data('receipt.xml')
+        response = self.post(make_zip([('a/receipt.xml', receipt), ('b/receipt.xml', receipt)]), 'application/zip')
+        self.assertEqual(response.status_code, 200)
+        names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+        self.assertEqual(names, ['a/parsed_receipt.xml', 'b/parsed_receipt.xml'])
+
+    @override_settings(API_MAX_DOCUMENT_SIZE=1000)
+    def test_oversized_documents(self):
+        large = b'<a>' + b' ' * 100_000 + b'</a>'
+        response = self.post(gzip.compress(large), HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 413)
+        response = self.post(make_zip([('large.xml', large)]), 'application/zip')
+        self.assertEqual(response.status_code, 413)
+        response = self.post(large + os.urandom(200_000), 'application/zip')
+        self.assertEqual(response.status_code, 413)
+
+    def test_broken_and_unsupported_encodings(self):
+        response = self.post(b'not gzip data', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['code'], 'invalid_encoding')
+        response = self.post(read_test_data('receipt.xml'), HTTP_CONTENT_ENCODING='br')
+        self.assertEqual(response.status_code, 415)
+
+
+class PercentileTests(TestCase):
+    """Load test percentiles use the nearest-rank method"""
+
+    def test_nearest_rank(self):
+        for size, percent, expected in (
+            (100, 50, 50), (100, 95, 95), (100, 99, 99), (100, 7, 7),
+            (10, 50, 5), (10, 95, 10), (10, 99, 10),
+            (20, 95, 19), (7, 50, 4), (1, 99, 1),
+        ):
+            with self.subTest(size=size, percent=percent):
+                self.assertEqual(percentile(list(range(1, size + 1)), percent), expected)
+
+    def test_empty_values(self):
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+class LoadtestSeedTests(TestCase):
+    """The load test removes its user, profile and recorded runs"""
+
+    def test_restore_deletes_synthetic_runs(self):
+        documents = {'orders': b'<orders/>', 'receipts': b'<receipts/>'}
+        restore = LoadtestCommand().seed('http://127.0.0.1:1/', documents)
+        profile = ShopProfile.objects.get(slug='loadtest')
+        ProcessingRun.objects.create(kind='orders', source='web', profile=profile, duration=1)
+        ProcessingRun.objects.create(kind='receipts', source='web', input_bytes=len(documents['receipts']), duration=1)
+        other = ProcessingRun.objects.create(kind='receipts', source='web', input_bytes=100, duration=1)
+
+        restore()
+        self.assertEqual(list(ProcessingRun.objects.all()), [other])
+        self.assertFalse(ShopProfile.objects.filter(slug='loadtest').exists())
+        self.assertFalse(User.objects.filter(username='loadtest').exists())
+
+
+@mock.patch('xml_editor.views.get_catalog', lambda *args: ProductCatalog(FEED))
+class ShopProfileSelectionTests(TestCase):
+    """Views never fall back to another shop when the selected one does not exist"""
+
+    def setUp(self):
+        self.default = create_profile('default', bank_id='EUR1')
+        self.other = create_profile('other', bank_id='EUR2')
+        self.client.force_login(User.objects.create_user('user'))
+
+    def upload(self, url_name, **data):
+        upload = io.BytesIO(read_test_data('orders.xml'))
+        upload.name = 'orders.xml'
+        return self.client.post(reverse(url_name), {'xml_file': upload, **data})
+
+    def test_selected_profile_is_used(self):
+        response = self.upload('home', profile='other')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<typ:ids>EUR2</typ:ids>', response.content)
+        self.assertEqual(self.client.session['shop_profile'], 'other')
+
+    def test_default_profile_without_selection(self):
+        response = self.upload('home')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<typ:ids>EUR1</typ:ids>', response.content)
+
+    def test_deleted_session_profile_falls_back_to_default(self):
+        session = self.client.session
+        session['shop_profile'] = 'deleted-shop'
+        session.save()
+        response = self.upload('home')
+        self.assertIn(b'<typ:ids>EUR1</typ:ids>', response.content)
+
+    def test_unknown_profile_is_rejected(self):
+        response = self.upload('home', profile='deleted-shop')
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertNotIn('shop_profile', self.client.session)
+
+    def test_unknown_profile_is_rejected_by_stream(self):
+        response = self.upload('home_stream', profile='deleted-shop')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('deleted-shop', response.json()['error'])
+
+    def test_unknown_profile_settings_are_not_changed(self):
+        response = self.client.post(reverse('settings'), {'profile': 'deleted-shop', 'bank_id': 'CHANGED'})
+        self.assertRedirects(response, reverse('settings'), fetch_redirect_response=False)
+        self.assertFalse(Settings.objects.filter(value='CHANGED').exists())
+        response = self.client.get(reverse('settings'), {'profile': 'deleted-shop'})
+        self.assertRedirects(response, reverse('settings'), fetch_redirect_response=False)
+
+
+@override_settings(RUN_HISTORY_ENABLED=False)
+class FeedLoadingTests(TestCase):
+    """The web form and the progress stream load the feed once and only when expand_sets runs"""
+
+    def setUp(self):
+        clear_catalogs()
+        self.addCleanup(clear_catalogs)
+        self.client.force_login(User.objects.create_user('user'))
+
+    def upload(self, url_name):
+        upload = io.BytesIO(read_test_data('orders.xml'))
+        upload.name = 'orders.xml'
+        return self.client.post(reverse(url_name), {'xml_file': upload})
+
+    def stream(self):
+        response = self.upload('home_stream')
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_empty_feed_url_is_not_loaded(self):
+        create_profile('shop', feed_url='')
+        with mock.patch('xml_editor.utils.requests.get') as get:
+            response = self.upload('home')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'<typ:ids>102246_100239</typ:ids>', response.content)
+            self.assertIn('event: result', self.stream())
+        get.assert_not_called()
+
+    def test_unavailable_feed_is_loaded_once(self):
+        create_profile('shop')
+        with mock.patch('xml_editor.utils.requests.get', side_effect=requests.ConnectionError) as get:
+            response = self.upload('home')
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(get.call_count, 1)
+        self.assertIsNotNone(get.call_args.kwargs['timeout'])
+
+    def test_unavailable_feed_is_loaded_once_by_stream(self):
+        create_profile('shop')
+        with mock.patch('xml_editor.utils.requests.get', side_effect=requests.ConnectionError) as get:
+            events = self.stream()
+        self.assertIn('event: error', events)
+        self.assertNotIn('event: result', events)
+        self.assertEqual(get.call_count, 1)
+
+
+@override_settings(RUN_HISTORY_RETENTION_DAYS=30, RUN_HISTORY_DAILY_RETENTION_DAYS=365)
+class RunHistoryTests(TestCase):
+    """Old runs are rolled up into daily totals which expire as well"""
+
+    now = datetime(2026, 6, 30, 12, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.profile = create_profile('shop')
+
+    def create_run(self, created, profile=None, **fields):
+        fields = {'kind': 'orders', 'source': 'web', 'duration': 1.0, 'input_bytes': 1000, 'invoices': 2, **fields}
+        run = ProcessingRun.objects.create(profile=profile, **fields)
+        # created is set automatically on insert
+        ProcessingRun.objects.filter(pk=run.pk).update(created=created)
+        return run
+
+    def test_rollup_twice_into_the_same_daily_totals(self):
+        day = datetime(2026, 5, 1, 12, tzinfo=timezone.utc)
+        for profile in (None, self.profile):
+            self.create_run(day, profile, duration=1.0)
+            self.create_run(day, profile, duration=3.0, success=False)
+        self.assertEqual(rollup_runs(self.now), 4)
+
+        for profile in (None, self.profile):
+            self.create_run(day + timedelta(hours=1), profile, duration=2.0)
+        self.assertEqual(rollup_runs(self.now), 2)
+
+        self.assertFalse(ProcessingRun.objects.exists())
+        self.assertEqual(ProcessingRunDaily.objects.count(), 2)
+        for profile in (None, self.profile):
+            daily = ProcessingRunDaily.objects.get(date=date(2026, 5, 1), kind='orders', profile=profile)
+            self.assertEqual(daily.runs, 3)
+            self.assertEqual(daily.failed_runs, 1)
+            self.assertEqual(daily.invoices, 6)
+            self.assertEqual(daily.input_bytes, 3000)
+            self.assertEqual(daily.duration, 6.0)
+            self.assertEqual(daily.max_duration, 3.0)
+
+    def test_set_cache_counters_are_recorded_and_rolled_up(self):
+        catalog = ProductCatalog(FEED)
+        for _ in range(2):
+            with RunRecorder('orders', 'web', self.profile) as run:
+                process_orders_xml(
+                    xml_data=read_test_data('orders.xml'), xml_feed=catalog, stats=run.stats, **ORDER_SETTINGS
+                )
+        first, second = ProcessingRun.objects.order_by('pk')
+        self.assertEqual((first.set_cache_hits, first.set_cache_misses), (0, 3))
+        self.assertEqual((second.set_cache_hits, second.set_cache_misses), (3, 0))
+
+        rollup_runs(datetime.now(timezone.utc) + timedelta(days=1))
+        daily = ProcessingRunDaily.objects.get()
+        self.assertEqual((daily.set_cache_hits, daily.set_cache_misses), (3, 3))
+
+    def test_prune_history(self):
+        recent = self.create_run(self.now - timedelta(days=5))
+        self.create_run(self.now - timedelta(days=40))
+        ProcessingRunDaily.objects.create(date=date(2025, 1, 1), kind='orders', runs=1)
+        ProcessingRunDaily.objects.create(date=date(2026, 1, 1), kind='orders', runs=1)
+
+        self.assertEqual(prune_history(self.now), (1, 1))
+        self.assertEqual(list(ProcessingRun.objects.all()), [recent])
+        self.assertEqual(
+            sorted(ProcessingRunDaily.objects.values_list('date', flat=True)),
+            [date(2026, 1, 1), date(2026, 5, 21)]
+        )
+
+    def test_daily_series_combines_runs_and_daily_totals(self):
+        today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+        yesterday = today - timedelta(days=1)
+        self.create_run(today, duration=1.0, input_bytes=2_000_000)
+        self.create_run(today, duration=3.0, input_bytes=2_000_000, kind='receipts')
+        self.create_run(yesterday, duration=2.0, input_bytes=1_000_000)
+        ProcessingRunDaily.objects.create(
+            date=yesterday.date(), kind='orders', runs=1, input_bytes=3_000_000, duration=2.0, max_duration=2.0
+        )
+
+        series = daily_series(7)
+        self.assertEqual([day['date'] for day in series], [yesterday.date().isoformat(), today.date().isoformat()])
+        self.assertEqual(series[0]['runs'], 2)
+        self.assertEqual(series[0]['throughput'], 1.0)
+        self.assertEqual(series[1], {
+            'date': today.date().isoformat(), 'runs': 2, 'failed_runs': 0,
+            'throughput': 1.0, 'avg_latency': 2000.0, 'max_latency': 3000.0,
+        })
+        self.assertEqual([day['runs'] for day in daily_series(7, 'receipts')], [1])
+
+
+class RunsDashboardTests(TestCase):
+    """Staff users see the recorded runs and the catalogs cached by the process"""
+
+    def setUp(self):
+        clear_catalogs()
+        self.addCleanup(clear_catalogs)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def test_dashboard_shows_cache_counters(self):
+        ProcessingRun.objects.create(kind='orders', source='api', duration=1, set_cache_hits=7, set_cache_misses=2)
+        with mock.patch('xml_editor.catalog.fetch_and_parse_xml_feed', return_value=FEED):
+            catalog = get_catalog('https://feed.example/', 'hash', 'shop')
+        catalog.expand_bundle('102246_100239', 'home')
+
+        response = self.client.get(reverse('runs'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '7 / 2')
+        self.assertEqual(response.context['catalog_cache']['tenants']['shop']['misses'], 1)
+
+    def test_dashboard_is_for_staff_only(self):
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.client.get(reverse('runs')).status_code, 302)
+
+
+class AsyncOrdersViewTests(TestCase):
+    """The async view downloads the catalog of the selected shop while the upload is parsed"""
+
+    def setUp(self):
+        self.default = create_profile('default', bank_id='EUR1')
+        self.other = create_profile('other', bank_id='EUR2')
+        self.user = User.objects.create_user('user')
+        self.session = SessionStore()
+        self.session['shop_profile'] = 'default'
+        patcher = mock.patch('xml_editor.async_views.get_catalog', side_effect=lambda *args: ProductCatalog(FEED))
+        self.get_catalog = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, **data):
+        upload = SimpleUploadedFile('orders.xml', read_test_data('orders.xml'), 'application/xml')
+        request = AsyncRequestFactory().post('/', {'xml_file': upload, **data})
+        request.user = self.user
+        request.session = self.session
+        request._messages = SessionStorage(request)
+        return request
+
+    def tenants(self):
+        return [call.args[2] for call in self.get_catalog.call_args_list]
+
+    async def test_orders_are_converted(self):
+        response = await async_views.index(self.request())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, read_test_data('orders_expected.xml'))
+        self.assertEqual(self.tenants(), ['default'])
+        run = await ProcessingRun.objects.aget()
+        self.assertEqual((run.source, run.success, run.sets_expanded), ('async', True, 3))
+
+    async def test_other_profile_restarts_catalog_download(self):
+        response = await async_views.index(self.request(profile='other'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<typ:ids>EUR2</typ:ids>', response.content)
+        self.assertEqual(self.tenants(), ['default', 'other'])
+        self.assertEqual(self.session['shop_profile'], 'other')
+
+    async def test_unavailable_feed(self):
+        self.get_catalog.side_effect = lambda *args: None
+        request = self.request()
+        response = await async_views.index(request)
+        self.assertEqual((response.status_code, response.url), (302, reverse('home')))
+        self.assertEqual(
+            [str(message) for message in get_messages(request)],
+            ['Nepovedlo se zpracovat XML soubor: Nepodařilo se načíst produktový feed.']
+        )
+        run = await ProcessingRun.objects.aget()
+        self.assertFalse(run.success)
+
+    async def test_unknown_profile_is_rejected(self):
+        request = self.request(profile='deleted-shop')
+        response = await async_views.index(request)
+        self.assertEqual((response.status_code, response.url), (302, reverse('home')))
+        self.assertEqual([str(message) for message in get_messages(request)], ['Vybraný obchod neexistuje: deleted-shop'])
+        self.assertFalse(await ProcessingRun.objects.aexists())
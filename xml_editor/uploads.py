@@ -0,0 +1,194 @@
+import gzip
+import io
+import os
+import posixpath
+import zipfile
+
+from django.http import HttpResponse
+
+# File name suffixes accepted by the upload forms, the API and the command
+SUPPORTED_SUFFIXES = ('.xml', '.xml.gz', '.gz', '.zip')
+
+# Size of the chunks read by LimitedReader.read() without a size
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class UnsupportedUpload(ValueError):
+    """Upload is not an XML file or a supported archive"""
+
+
+class DocumentTooLarge(ValueError):
+    """Decompressed document exceeds the allowed size"""
+
+
+class LimitedReader(io.RawIOBase):
+    """File-like wrapper that fails once more than max_size bytes are read"""
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        # never ask the stream for more than one byte over the limit,
+        # so an oversized body is not read into memory before it is rejected
+        data = self.stream.read(min(size, self.max_size - self.bytes_read + 1))
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_size:
+            raise DocumentTooLarge(f'Document exceeds {self.max_size} bytes.')
+        return data
+
+    def readall(self):
+        chunks = []
+        while True:
+            chunk = self.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+def is_supported_upload(filename):
+    return filename.lower().endswith(SUPPORTED_SUFFIXES)
+
+
+def open_xml_sources(fileobj, filename, content_encoding=None, max_size=None):
+    """
+    Yield XML documents of an upload as streams, decompressed on the fly
+
+    Nothing is decompressed to memory or disk up front, the parser reads
+    the returned streams directly.
+
+    Supported uploads:
+        name.xml: plain XML
+        name.xml.gz / name.gz: gzip compressed XML
+        name.zip: one or more XML files in a ZIP archive
+    A gzip Content-Encoding of the whole body is removed first.
+
+    Args:
+        fileobj: Binary file-like object with the upload
+        filename (str): Name of the uploaded file
+        content_encoding (str, optional): Content-Encoding of the upload
+        max_size (int, optional): Maximum size of a decompressed document
+
+    Yields:
+        tuple: (name of the XML document, binary stream), documents of an
+            archive keep their relative path in the archive, e.g. ``a/x.xml``
+
+    Raises:
+        UnsupportedUpload: If the file type or encoding is not supported
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding == 'gzip':
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    elif encoding not in ('', 'identity'):
+        raise UnsupportedUpload(f'Unsupported Content-Encoding: {encoding}')
+
+    name = os.path.basename(filename)
+    lower_name = name.lower()
+    if lower_name.endswith('.zip'):
+        archive = zipfile.ZipFile(fileobj)
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith('.xml')
+            and not info.filename.startswith('__MACOSX/')
+        ]
+        if not members:
+            raise UnsupportedUpload('Archiv neobsahuje žádný XML soubor.')
+        names = set()
+        for info in members:
+            yield unique_name(member_name(info.filename), names), _limit(archive.open(info), max_size)
+    elif lower_name.endswith('.gz'):
+        xml_name = name[:-3] if lower_name.endswith('.xml.gz') else name[:-3] + '.xml'
+        yield xml_name, _limit(gzip.GzipFile(fileobj=fileobj, mode='rb'), max_size)
+    elif lower_name.endswith('.xml'):
+        yield name, _limit(fileobj, max_size) if encoding == 'gzip' else fileobj
+    else:
+        raise UnsupportedUpload('Prosím vyberte XML soubor nebo archiv (.xml, .xml.gz, .zip).')
+
+
+def member_name(filename):
+    """Return the relative path of an archive member without absolute or parent parts"""
+    parts = [part for part in filename.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts)
+
+
+def unique_name(name, names):
+    """Return name, with a counter added when it is already in names, and remember it"""
+    base, ext = posixpath.splitext(name)
+    candidate = name
+    counter = 1
+    while candidate.lower() in names:
+        counter += 1
+        candidate = f'{base}_{counter}{ext}'
+    names.add(candidate.lower())
+    return candidate
+
+
+def prefixed_name(prefix, name):
+    """Add prefix to the file name of a relative path, e.g. ``a/modified_x.xml``"""
+    directory, basename = posixpath.split(name)
+    return posixpath.join(directory, prefix + basename)
+
+
+def _limit(stream, max_size):
+    return stream if max_size is None else LimitedReader(stream, max_size)
+
+
+def zip_documents(documents):
+    """
+    Pack converted documents into a ZIP archive
+
+    Args:
+        documents (list): (file name, XML string) tuples
+
+    Returns:
+        bytes: ZIP archive
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, xml_data in documents:
+            archive.writestr(name, xml_data)
+    return buffer.getvalue()
+
+
+def documents_response(documents, archive_name, timings=None):
+    """
+    Return a single converted document as XML, several documents as a ZIP archive
+
+    Args:
+        documents (list): (file name, XML string) tuples
+        archive_name (str): Name of the upload, the ZIP archive is named after it
+        timings (dict, optional): Stage durations in seconds for the Server-Timing header
+
+    Returns:
+        HttpResponse: Attachment with the document or the archive
+    """
+    if len(documents) == 1:
+        name, xml_data = documents[0]
+        name = name.rsplit('/', 1)[-1]
+        response = HttpResponse(xml_data, content_type='application/xml; charset=utf-8')
+    else:
+        name = archive_name.rsplit('.', 1)[0] + '.zip'
+        response = HttpResponse(zip_documents(documents), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{name}"'
+    if timings:
+        # stage durations in milliseconds, see https://www.w3.org/TR/server-timing/
+        response['Server-Timing'] = ', '.join(
+            f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()
+        )
+    return response
@@ -1,8 +1,16 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, api, async_views
+
+# ASGI deployments can serve the upload forms with the async views
+upload_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('', views.index, name='home'),
-    path('receipts/', views.receipts, name='receipts'),
+    path('', upload_views.index, name='home'),
+    path('stream/', views.index_stream, name='home_stream'),
+    path('receipts/', upload_views.receipts, name='receipts'),
     path('settings/', views.settings, name='settings'),
-]
\ No newline at end of file
+    path('runs/', views.runs_dashboard, name='runs'),
+    path('api/orders/', api.orders, name='api_orders'),
+    path('api/receipts/', api.receipts, name='api_receipts'),
+]
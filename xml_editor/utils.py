@@ -1,10 +1,17 @@
 from lxml import etree
 import os
+import time
 from datetime import datetime
 import json
 import xmltodict
 import requests
 
+# Number of processed elements between two progress reports
+PROGRESS_INTERVAL = 100
+
+# Seconds to wait for the product feed server
+FEED_TIMEOUT = 30
+
 def fetch_and_parse_xml_feed(url: str, api_key: str) -> dict:
     """
     Fetches XML data from a given URL and converts it to a dictionary.
@@ -16,7 +23,7 @@ def fetch_and_parse_xml_feed(url: str, api_key: str) -> dict:
         dict: The XML data converted to a dictionary.
     """
     try:
-        response = requests.get(url, headers={'Authorization': api_key})
+        response = requests.get(url, headers={'Authorization': api_key}, timeout=FEED_TIMEOUT)
         response.raise_for_status()  # Raise an error for bad responses
         return response.json()['data']
     except requests.exceptions.RequestException as e:
@@ -24,9 +31,12 @@ def fetch_and_parse_xml_feed(url: str, api_key: str) -> dict:
         return None
 
 def parse_xml_to_etree(data):
-    """Parse XML data to an ElementTree object"""
+    """Parse XML data (string, bytes or binary file-like object) to an ElementTree object"""
     try:
         parser = etree.XMLParser(remove_blank_text=True)
+        if hasattr(data, 'read'):
+            # file-like objects are parsed incrementally as they are read
+            return etree.parse(data, parser).getroot()
         tree = etree.fromstring(data, parser)
         return tree
     except etree.XMLSyntaxError as e:
@@ -172,9 +182,11 @@ def create_invoice_item_foreign_currency(root, item_data):
     
     return invoice_item 
 
-def update_unit_prices(root, bank_id, account_no, bank_code, const_symbol, store_id, feed_url, hash, eur_rate):
+def update_unit_prices(root, bank_id, account_no, bank_code, const_symbol, store_id, feed_url, hash, eur_rate, xml_feed=None, stats=None, progress=None, skip_stages=()):
     """
     Update unitPrice to be the sum of price and priceVAT in homeCurrency for all invoice items
+
+    Runs all stages of the orders pipeline (see xml_editor.pipeline).
     
     Args:
         root: XML root element
@@ -186,170 +198,35 @@ def update_unit_prices(root, bank_id, account_no, bank_code, const_symbol, store
         feed_url (str): URL of the XML feed
         hash (str): Hash for authentication
         eur_rate (float): EUR exchange rate
+        xml_feed (ProductCatalog/list, optional): Already loaded product catalog or feed, fetched from feed_url when not given
+        stats (dict, optional): Counters of the run (expanded sets, set cache hits and misses, stage timings)
+        progress (callable, optional): Called as progress(stage, processed, total) while the stages run
+        skip_stages (iterable, optional): Names of the pipeline stages to skip
     """
-    namespaces = {
-        'dat': root.nsmap['dat'],
-        'inv': root.nsmap['inv'],
-        'typ': root.nsmap['typ']
-    }
-
-    vat_rate = {
-        '21': 'high',
-        '12': 'medium',
-        '10': 'low',
-    }
-
-    # Remove inv:code only for shipping and billing items
-    for invoice_item in root.findall('.//inv:invoiceItem', namespaces):
-        code_elem = invoice_item.find('inv:code', namespaces)
-        if code_elem is not None:
-            code_value = code_elem.text
-            if code_value and ('SHIPPING' in code_value or 'BILLING' in code_value):
-                delete_element(invoice_item, code_elem)
-
-    # load XML feed
-    xml_feed = fetch_and_parse_xml_feed(feed_url, hash)
-
-    for inv_item in root.findall('.//inv:invoiceItem', namespaces):
-        stock_item = inv_item.find('inv:stockItem', namespaces)
-        # check if stockItem exists
-        if stock_item is not None:
-            # check if stockItem ids contains underscore
-            stock_item = stock_item.find('typ:stockItem', namespaces)
-            stock_item_ids = stock_item.find('typ:ids', namespaces)
-            if stock_item_ids is not None and '_' in stock_item_ids.text:
-                # split stockItem ids by underscore
-                stock_item_ids_text = stock_item_ids.text.split('_')
-                home_currency = inv_item.find('inv:homeCurrency', namespaces)
-                foreign_currency = inv_item.find('inv:foreignCurrency', namespaces)
-                quantity = inv_item.find('inv:quantity', namespaces)
-                invoice = inv_item.getparent()
-                delete_element(inv_item.getparent(), inv_item)
-                
-                for stock_item_id in stock_item_ids_text:
-                    # find stockItem in XML feed by product_id
-                    product_obj = next((item for item in xml_feed if item['PRODUCT_CODE'] == stock_item_id), None)
-                    # create new invoiceItem
-                    if product_obj is not None:
-                        price_vat = float(product_obj['PRICE_VAT']) - float(product_obj['PRICE'])
-                        if home_currency is not None:
-                            # create new invoiceItem in home currency
-                            item_data = {
-                                'text': product_obj['PRODUCT'],
-                                'quantity': quantity.text,
-                                'unit': 'ks',
-                                'payVAT': False,
-                                'rateVAT': vat_rate.get(str(product_obj['VAT']), 'high'),
-                                'unitPrice': float(product_obj['PRICE_VAT']),
-                                'price': float(product_obj['PRICE']),
-                                'priceVAT': float(product_obj['PRICE_VAT']) - float(product_obj['PRICE']),
-                                'stockItemId': stock_item_id,
-                                'code': stock_item_id
-                            }
-                            new_inv_el = create_invoice_item_home_currency(root, item_data)
-                            
-                            # add new invoinceItem to invoice
-
-                        elif foreign_currency is not None:
-                            exchange_rate = float(eur_rate)
-                            unit_price = round(float(product_obj['PRICE_VAT']) / exchange_rate, 2)
-                            price = round(float(product_obj['PRICE']) / exchange_rate, 2)
-                            price_vat = round((float(product_obj['PRICE_VAT']) - float(product_obj['PRICE']))/ exchange_rate,2)
-                            item_data = {
-                                'text': product_obj['PRODUCT'],
-                                'quantity': quantity.text,
-                                'unit': 'ks',
-                                'payVAT': False,
-                                'rateVAT': vat_rate.get(str(product_obj['VAT']), 'high'),
-                                'unitPrice': unit_price,
-                                'price': price,
-                                'priceVAT': price_vat,
-                                'stockItemId': stock_item_id,
-                                'code': stock_item_id
-                            }
-                            # create new invoiceItem in foreign currency
-                            new_inv_el = create_invoice_item_foreign_currency(root, item_data)
-                            
-                        invoice.append(new_inv_el)
-
-
-    
-    # Process invoice items in home currency
-    # and update unitPrice accordingly
-    # This is the main part of the function
-    # It finds all invoice items and updates their unitPrice
-    # based on the price and priceVAT
-    # It also sets payVAT to true
-    # if the unitPrice is updated
-    for invoice_item in root.findall('.//inv:invoiceItem', namespaces):
-        home_currency = invoice_item.find('inv:homeCurrency', namespaces)
-        foreign_currency = invoice_item.find('inv:foreignCurrency', namespaces)
-        if home_currency is not None:
-            price_elem = home_currency.find('typ:price', namespaces)
-            price_vat_elem = home_currency.find('typ:priceVAT', namespaces)
-            unit_price_elem = home_currency.find('typ:unitPrice', namespaces)
-            pay_vat_elem = invoice_item.find('inv:payVAT', namespaces)
-            
-            if all([price_elem is not None, price_vat_elem is not None, unit_price_elem is not None]):
-                try:
-                    price = float(price_elem.text)
-                    price_vat = float(price_vat_elem.text)
-                    new_unit_price = price + price_vat
-                    unit_price_elem.text = f"{new_unit_price:.2f}"
-                    pay_vat_elem.text = 'true'
-                except (ValueError, TypeError) as e:
-                    print(f"Error processing prices: {e}")
-
-        # Process foreign currency if it exists
-        # and update unitPrice accordingly
-        # This is similar to the home currency processing but for foreign currency
-        if foreign_currency is not None:
-            price_elem = foreign_currency.find('typ:price', namespaces)
-            price_vat_elem = foreign_currency.find('typ:priceVAT', namespaces)
-            unit_price_elem = foreign_currency.find('typ:unitPrice', namespaces)
-            pay_vat_elem = invoice_item.find('inv:payVAT', namespaces)
-            
-            if all([price_elem is not None, price_vat_elem is not None, unit_price_elem is not None]):
-                try:
-                    price = float(price_elem.text)
-                    price_vat = float(price_vat_elem.text)
-                    new_unit_price = price + price_vat
-                    unit_price_elem.text = f"{new_unit_price:.2f}"
-                    pay_vat_elem.text = 'true'
-                except (ValueError, TypeError) as e:
-                    print(f"Error processing prices: {e}")
-
-        # add store subelement to stockItem
-        stock_item = invoice_item.find('inv:stockItem', namespaces)
-
-        if stock_item is not None and store_id is not None:
-            # Add store subelement to stockItem and set its value
-            store_elem = add_element(stock_item, 'typ:store')
-            add_element(store_elem, 'typ:ids', store_id)
-
-    # Update invoice header with bank details
-    # and symConst if provided
-    # Only if the currency is EUR
-    for invoice in root.findall('.//inv:invoice', namespaces):
-        invoice_header = invoice.find('inv:invoiceHeader', namespaces)
-        invoice_summary = invoice.find('inv:invoiceSummary', namespaces)
-        if invoice_summary is not None:
-            currency_id_elem = invoice_summary.find('inv:foreignCurrency/typ:currency/typ:ids', namespaces)
-            if currency_id_elem is not None and currency_id_elem.text == 'EUR':
-                if bank_id is not None:
-                    account_elem = add_element(invoice_header, 'inv:account')
-                    add_element(account_elem, 'typ:ids', bank_id)
-                    add_element(account_elem, 'typ:accountNo', account_no)
-                    add_element(account_elem, 'typ:bankCode', bank_code)
-                    if const_symbol is not None:
-                        add_element(invoice_header, 'inv:symConst', const_symbol)
-
-def process_orders_xml(xml_data, bank_id, account_no, bank_code, const_symbol, store_id, feed_url, hash, eur_rate):
+    from .pipeline import OrderContext, run_pipeline
+
+    context = OrderContext(
+        root,
+        bank_id=bank_id,
+        account_no=account_no,
+        bank_code=bank_code,
+        const_symbol=const_symbol,
+        store_id=store_id,
+        feed_url=feed_url,
+        hash=hash,
+        eur_rate=eur_rate,
+        xml_feed=xml_feed,
+        stats=stats,
+        progress=progress,
+    )
+    run_pipeline(context, skip=skip_stages)
+
+def process_orders_xml(xml_data, bank_id, account_no, bank_code, const_symbol, store_id, feed_url, hash, eur_rate, xml_feed=None, stats=None, progress=None, skip_stages=()):
     """
     Edit XML data and return modified XML as string
     
     Args:
-        xml_data (str/bytes): Input XML data
+        xml_data (str/bytes/file): Input XML data
         bank_id (str): Bank ID
         account_no (str): Account number
         bank_code (str): Bank code
@@ -358,18 +235,47 @@ def process_orders_xml(xml_data, bank_id, account_no, bank_code, const_symbol, s
         feed_url (str): URL of the XML feed
         hash (str): Hash for authentication
         eur_rate (float): EUR exchange rate
+        xml_feed (ProductCatalog/list, optional): Already loaded product catalog or feed, fetched from feed_url when not given
+        stats (dict, optional): Counters of the run (expanded sets, set cache hits and misses, stage timings)
+        progress (callable, optional): Called as progress(stage, processed, total) while the stages run
+        skip_stages (iterable, optional): Names of the pipeline stages to skip
         
     Returns:
         str: Modified XML data as string
     """
-    tree = parse_xml_to_etree(xml_data)
+    if stats is None:
+        stats = {}
+
+    tree = parse_orders_xml(xml_data, stats, progress)
     if tree is None:
         return None
         
     root = tree
-    update_unit_prices(root, bank_id, account_no, bank_code, const_symbol, store_id, feed_url, hash, eur_rate)
+    update_unit_prices(root, bank_id, account_no, bank_code, const_symbol, store_id, feed_url, hash, eur_rate, xml_feed, stats, progress, skip_stages)
     
-    return etree.tostring(root, encoding='utf-8', xml_declaration=True, pretty_print=True).decode('utf-8')
+    return serialize_orders_xml(root, stats, progress)
+
+def parse_orders_xml(xml_data, stats=None, progress=None):
+    """Parse orders XML data, the duration is added to stats['timings']['parse']"""
+    if progress is not None:
+        progress('parse', 0, 1)
+    start = time.perf_counter()
+    tree = parse_xml_to_etree(xml_data)
+    if stats is not None:
+        timings = stats.setdefault('timings', {})
+        timings['parse'] = timings.get('parse', 0.0) + time.perf_counter() - start
+    return tree
+
+def serialize_orders_xml(root, stats=None, progress=None):
+    """Serialize modified orders XML to string, the duration is added to stats['timings']['serialize']"""
+    if progress is not None:
+        progress('serialize', 0, 1)
+    start = time.perf_counter()
+    output = etree.tostring(root, encoding='utf-8', xml_declaration=True, pretty_print=True).decode('utf-8')
+    if stats is not None:
+        timings = stats.setdefault('timings', {})
+        timings['serialize'] = timings.get('serialize', 0.0) + time.perf_counter() - start
+    return output
 
 
 import lxml
@@ -382,7 +288,7 @@ def parse_receipt_xml(xml_string: str) -> dict:
     Parse the XML string into a dictionary.
 
     Args:
-        xml_string (str): The XML string to parse.
+        xml_string (str/bytes/file): The XML string or binary file-like object to parse.
 
     Returns:
         dict: The parsed XML as a dictionary.
@@ -1,48 +1,142 @@
 from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
+from django.urls import reverse
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import HttpResponse
-from .models import Settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.conf import settings as django_settings
+from django.views.decorators.http import require_POST
+from .catalog import CatalogUnavailable, catalog_cache_info, get_catalog
+from .history import RunRecorder, daily_series
+from .models import ProcessingRun, Settings, ShopProfile
+from .pipeline import needs_catalog
+from .progress import astream_orders_processing, stream_orders_processing
+from .uploads import documents_response, is_supported_upload, open_xml_sources, prefixed_name
 from .utils import process_orders_xml, parse_receipt_xml, create_receipt_xml
 
 
+def get_shop_profile(request, slug=None):
+    """
+    Return the selected shop profile and remember it in the session
+
+    Without a slug the profile remembered in the session is used, or the
+    default profile when the remembered one no longer exists.
+
+    Raises:
+        ShopProfile.DoesNotExist: If the profile of the given slug does not exist
+    """
+    if slug:
+        profile = ShopProfile.objects.filter(slug=slug).first()
+        if profile is None:
+            # never process the upload with another shop's bank, store and feed
+            raise ShopProfile.DoesNotExist(f'Vybraný obchod neexistuje: {slug}')
+    else:
+        remembered = request.session.get('shop_profile')
+        profile = ShopProfile.objects.filter(slug=remembered).first() if remembered else None
+        if profile is None:
+            profile = ShopProfile.get_default()
+    if profile is not None:
+        request.session['shop_profile'] = profile.slug
+    return profile
+
+
 @login_required(login_url='/auth/login')
 def index(request):
     if request.method == 'GET':
-        return render(request, 'index.html')
+        context = {
+            'profiles': ShopProfile.objects.all(),
+            'profile': get_shop_profile(request),
+        }
+        return render(request, 'index.html', context)
     if request.method == 'POST':
         # Handle file upload
         uploaded_file = request.FILES['xml_file']
-        if not uploaded_file.name.endswith('.xml'):
-            messages.error(request, 'Prosím vyberte XML soubor.')
+        if not is_supported_upload(uploaded_file.name):
+            messages.error(request, 'Prosím vyberte XML soubor nebo archiv (.xml, .xml.gz, .zip).')
             return redirect('home')
         
-        # read the file content
-        file_content = uploaded_file.read()
-        # load settings from the database
-        settings = Settings.objects.all()
+        # load settings of the selected shop from the database
         try:
-            modified_xml = process_orders_xml(
-                xml_data=file_content,
-                bank_id=settings.get(code='bank_id').value,
-                account_no=settings.get(code='account_no').value,
-                bank_code=settings.get(code='bank_code').value,
-                const_symbol=settings.get(code='const_symbol').value,
-                store_id=settings.get(code='store_id').value,
-                feed_url=settings.get(code='feed_url').value,
-                hash=settings.get(code='hash').value,
-                eur_rate=settings.get(code='eur_rate').value
-            )
+            profile = get_shop_profile(request, request.POST.get('profile'))
+        except ShopProfile.DoesNotExist as e:
+            messages.error(request, str(e))
+            return redirect('home')
+        try:
+            with RunRecorder('orders', 'web', profile, uploaded_file.size) as run:
+                order_settings = Settings.get_order_settings(profile)
+                catalog = None
+                if needs_catalog(order_settings):
+                    catalog = run.catalog = get_catalog(order_settings['feed_url'], order_settings['hash'], profile.slug)
+                    if catalog is None:
+                        raise CatalogUnavailable()
+
+                # the upload is decompressed while it is parsed
+                documents = []
+                sources = open_xml_sources(uploaded_file, uploaded_file.name, max_size=django_settings.MAX_DECOMPRESSED_SIZE)
+                for name, stream in sources:
+                    modified_xml = process_orders_xml(xml_data=stream, xml_feed=catalog, stats=run.stats, **order_settings)
+                    if modified_xml is None:
+                        raise ValueError(f'{name} není platný XML soubor')
+                    documents.append((prefixed_name('modified_', name), modified_xml))
+                    run.documents += 1
 
             # Prepare response with XML file
-            response = HttpResponse(modified_xml, content_type='application/xml; charset=utf-8')
-            response['Content-Disposition'] = f'attachment; filename="modified_{uploaded_file.name}"'
-            return response
+            return documents_response(documents, f'modified_{uploaded_file.name}')
 
         except Exception as e:
             messages.error(request, f'Nepovedlo se zpracovat XML soubor: {e}')
             return redirect('home')
-        
+
+
+# Maximum time (in seconds) a user is blocked from starting another processing
+PROCESSING_LOCK_TIMEOUT = 15 * 60
+
+
+@login_required(login_url='/auth/login')
+@require_POST
+def index_stream(request):
+    """Process orders XML and stream the progress as Server-Sent Events"""
+    uploaded_file = request.FILES.get('xml_file')
+    if uploaded_file is None or not is_supported_upload(uploaded_file.name):
+        return JsonResponse({'error': 'Prosím vyberte XML soubor nebo archiv (.xml, .xml.gz, .zip).'}, status=400)
+
+    # block duplicate submissions while the previous file is processed,
+    # with several worker processes the cache must be shared (see CACHES)
+    lock_key = f'xml_editor:processing:{request.user.pk}'
+    if not cache.add(lock_key, True, timeout=PROCESSING_LOCK_TIMEOUT):
+        return JsonResponse({'error': 'Předchozí soubor se stále zpracovává, počkejte prosím.'}, status=409)
+
+    try:
+        profile = get_shop_profile(request, request.POST.get('profile'))
+        order_settings = Settings.get_order_settings(profile)
+    except ShopProfile.DoesNotExist as e:
+        cache.delete(lock_key)
+        return JsonResponse({'error': str(e)}, status=404)
+    except Exception as e:
+        cache.delete(lock_key)
+        return JsonResponse({'error': f'Nepovedlo se zpracovat XML soubor: {e}'}, status=500)
+
+    # over ASGI a sync iterator would be buffered until the processing ends
+    stream = astream_orders_processing if isinstance(request, ASGIRequest) else stream_orders_processing
+    response = StreamingHttpResponse(
+        stream(
+            uploaded_file,
+            uploaded_file.name,
+            order_settings,
+            tenant=profile.slug,
+            max_size=django_settings.MAX_DECOMPRESSED_SIZE,
+            run=RunRecorder('orders', 'stream', profile, uploaded_file.size),
+            on_finish=lambda: cache.delete(lock_key)
+        ),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # disable buffering in reverse proxies
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def receipts(request):
     if request.method == 'GET':
         # Fetch receipts from the database
@@ -50,23 +144,25 @@ def receipts(request):
     if request.method == 'POST':
         # Handle file upload
         uploaded_file = request.FILES['xml_file']
-        if not uploaded_file.name.endswith('.xml'):
-            messages.error(request, 'Prosím vyberte XML soubor.')
+        if not is_supported_upload(uploaded_file.name):
+            messages.error(request, 'Prosím vyberte XML soubor nebo archiv (.xml, .xml.gz, .zip).')
             return redirect('receipts')
         
-        # read the file content
-        file_content = uploaded_file.read()
-        
-        # parse the XML file
+        # parse the XML files, the upload is decompressed while it is parsed
         try:
-            receipts = parse_receipt_xml(file_content)
-            # Create a new XML file with the parsed data
-            xml_data = create_receipt_xml(receipts)
+            with RunRecorder('receipts', 'web', input_bytes=uploaded_file.size) as run:
+                documents = []
+                sources = open_xml_sources(uploaded_file, uploaded_file.name, max_size=django_settings.MAX_DECOMPRESSED_SIZE)
+                for name, stream in sources:
+                    receipts = parse_receipt_xml(stream)
+                    # Create a new XML file with the parsed data
+                    xml_data = create_receipt_xml(receipts)
+                    documents.append((prefixed_name('parsed_', name), xml_data))
+                    run.documents += 1
+                    run.stats['items'] = run.stats.get('items', 0) + len(receipts)
             
             # Prepare response with XML file
-            response = HttpResponse(xml_data, content_type='application/xml; charset=utf-8')
-            response['Content-Disposition'] = f'attachment; filename="parsed_{uploaded_file.name}"'
-            return response
+            return documents_response(documents, f'parsed_{uploaded_file.name}')
         except Exception as e:
             messages.error(request, f'Nepovedlo se zpracovat XML soubor: {e}')
             return redirect('receipts')
@@ -75,12 +171,19 @@ def receipts(request):
 
 @login_required(login_url='/auth/login')
 def settings(request):
-    # get all settings from the database sorted by category
-    settings = Settings.objects.all().order_by('category')    
+    # get settings of the selected shop from the database sorted by category
+    try:
+        profile = get_shop_profile(request, request.GET.get('profile') or request.POST.get('profile'))
+    except ShopProfile.DoesNotExist as e:
+        messages.error(request, str(e))
+        return redirect('settings')
+    settings = Settings.objects.filter(profile=profile).order_by('category')
     if request.method == 'GET':
         # Fetch settings from the database
         context = {
-            'settings': settings
+            'settings': settings,
+            'profiles': ShopProfile.objects.all(),
+            'profile': profile,
         }
         return render(request, 'settings.html', context)
     if request.method == 'POST':
@@ -96,4 +199,34 @@ def settings(request):
                     setting.save()
         # Show success message
         messages.success(request, 'Nastavení úspěšně uloženo.')
-        return redirect('settings')
\ No newline at end of file
+        if profile is None:
+            return redirect('settings')
+        return redirect(f"{reverse('settings')}?profile={profile.slug}")
+
+
+# Periods offered by the processing statistics dashboard, in days
+DASHBOARD_PERIODS = (7, 30, 90, 365)
+
+
+@login_required(login_url='/auth/login')
+@user_passes_test(lambda user: user.is_staff, login_url='/auth/login')
+def runs_dashboard(request):
+    """Show throughput and latency of processing runs over time for staff users"""
+    days = int(request.GET['days']) if request.GET.get('days', '').isdigit() else 30
+    if days not in DASHBOARD_PERIODS:
+        days = 30
+    kind = request.GET.get('kind') if request.GET.get('kind') in dict(ProcessingRun.KIND_CHOICES) else ''
+    runs = ProcessingRun.objects.select_related('profile')
+    if kind:
+        runs = runs.filter(kind=kind)
+    context = {
+        'series': daily_series(days, kind or None),
+        'runs': runs[:50],
+        'days': days,
+        'kind': kind,
+        'periods': DASHBOARD_PERIODS,
+        'kinds': ProcessingRun.KIND_CHOICES,
+        # catalogs cached by the worker process serving this request
+        'catalog_cache': catalog_cache_info(),
+    }
+    return render(request, 'runs.html', context)